@@ -1 +1,2 @@
-__all__ = ["core", "dom", "model", "registry", "toolbox"]
+__all__ = ["batch", "benchmark", "cache", "core", "daemon", "dom",
+        "instrument", "model", "normals", "registry", "toolbox", "transform"]
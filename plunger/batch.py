@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007 by Kai Blin
+#
+# Plunger is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""Batch conversion of many assets on a pool of worker processes.
+
+Every worker loads the plugins once and converts job after job, so the
+interpreter start-up and plugin loading are paid once per core instead of
+once per file.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cache
+import core
+import instrument
+import registry
+import toolbox
+
+# Cache used by the jobs of this worker process, if any
+worker_cache = None
+
+# File keeping track of earlier runs for incremental rebuilds
+BUILD_STATE_NAME = ".plunger-state"
+# Bump this if the layout of the build state changes
+BUILD_STATE_VERSION = 2
+
+def outputName(path, input_format, output_format):
+    """Replace the extension of input_format by the one of output_format.
+    If input_format is None, the extension of any import format is replaced.
+    Compressed inputs give outputs compressed the same way.
+    """
+    (path, compressed_ext) = toolbox.splitCompressedExt(path)
+    output_ext = getExtension(output_format, registry.getExporter)
+    for input_ext in getInputExtensions(input_format):
+        if path.endswith(input_ext):
+            return path[:-len(input_ext)] + output_ext + compressed_ext
+    return path + output_ext + compressed_ext
+
+def getExtension(format, get_module):
+    """Get the file name extension of a format, including the dot
+    """
+    ext = getattr(get_module(format), "ext", "")
+    if not ext:
+        ext = format
+    if not ext.startswith("."):
+        ext = "." + ext
+    return ext
+
+def getInputExtensions(input_format):
+    """Get the extension of input_format, or those of all import formats if
+    it is None, longest first
+    """
+    input_formats = [input_format]
+    if input_format is None:
+        input_formats = registry.getImportFormats()
+    input_exts = [getExtension(format, registry.getImporter)
+            for format in input_formats]
+    input_exts.sort(key=len, reverse=True)
+    return input_exts
+
+def findJobs(input_dir, output_dir, input_format, output_format):
+    """Get (input, output) pairs for all files of input_format below
+    input_dir, or of all import formats if input_format is None, compressed
+    or not. The directory structure is mirrored below output_dir.
+    """
+    input_exts = tuple(getInputExtensions(input_format))
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not toolbox.splitCompressedExt(filename)[0].endswith(
+                    input_exts):
+                continue
+            input_asset = os.path.join(dirpath, filename)
+            relative = os.path.relpath(input_asset, input_dir)
+            jobs.append((input_asset, os.path.join(output_dir,
+                outputName(relative, input_format, output_format))))
+    return jobs
+
+def readManifest(stream, output_dir=""):
+    """Get (input, output) pairs from a manifest with one whitespace
+    separated pair per line. Empty lines and lines starting with # are
+    ignored, relative outputs are placed below output_dir.
+    """
+    jobs = []
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        (input_asset, output_asset) = line.split()
+        jobs.append((input_asset, os.path.join(output_dir, output_asset)))
+    return jobs
+
+def initWorker(input_format, output_format, cache_dir=None,
+        profile_path=None):
+    """Load the plugins needed by all jobs and open the cache once per worker
+    """
+    global worker_cache
+    instrument.enable(profile_path)
+    core.loadPlugins()
+    if cache_dir:
+        worker_cache = cache.ConversionCache(cache_dir)
+    if input_format is None:
+        for format in registry.getImportFormats():
+            registry.getImporter(format)
+    else:
+        registry.getImporter(input_format)
+    registry.getExporter(output_format)
+
+def convertJob(args):
+    """Convert one asset, returning (input, output, error, seconds, cached).
+    error is None if the conversion succeeded, cached is set if the output
+    was copied from the cache. If the input format is None, it is detected.
+    """
+    (input_asset, input_format, output_asset, output_format,
+            smoothing_angle, transform) = args
+    start = time.time()
+    error = None
+    cached = False
+    try:
+        output_dir = os.path.dirname(output_asset)
+        if output_dir and not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                # created by another worker in the meantime
+                if not os.path.isdir(output_dir):
+                    raise
+        source = input_asset
+        if input_format is None:
+            (input_format, source) = registry.detectFormat(input_asset)
+            if input_format is None:
+                raise ValueError("unknown input format")
+        conversion = core.convert(source, input_format, output_asset,
+                output_format, smoothing_angle, worker_cache, transform)
+        cached = conversion.cached
+    except SystemExit, e:
+        # plugins exit on errors they already reported
+        error = "exited with status %s" % e.code
+    except Exception, e:
+        error = e.__class__.__name__
+        if str(e):
+            error += ": %s" % e
+    return (input_asset, output_asset, error, time.time() - start, cached)
+
+def convertAll(jobs, input_format, output_format, smoothing_angle=None,
+        processes=None, cache_dir=None, transform=None):
+    """Convert all (input, output) pairs in jobs on "processes" worker
+    processes, one per core by default. If cache_dir is given, the workers
+    share a ConversionCache there. Returns the results of convertJob() in
+    job order.
+    """
+    job_args = [(input_asset, input_format, output_asset, output_format,
+            smoothing_angle, transform)
+            for (input_asset, output_asset) in jobs]
+
+    import multiprocessing
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(job_args))
+
+    if processes <= 1:
+        initWorker(input_format, output_format, cache_dir,
+                instrument.profile_path)
+        return map(convertJob, job_args)
+
+    # the workers profile their jobs if this process would
+    pool = multiprocessing.Pool(processes, initWorker,
+            (input_format, output_format, cache_dir, instrument.profile_path))
+    try:
+        results = pool.map(convertJob, job_args, chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    pool.join()
+    return results
+
+def getTools(input_format, output_format, options=None):
+    """Describe the plunger and plugin versions and the options used for a
+    conversion, outputs need to be rebuilt if this changes.
+    """
+    input_formats = [input_format]
+    if input_format is None:
+        input_formats = sorted(registry.getImportFormats())
+    tools = "plunger %s" % core.VERSION
+    for format in input_formats:
+        tools += ", %s %s" % (format,
+                getattr(registry.getImporter(format), "version", ""))
+    exporter = registry.getExporter(output_format)
+    tools += ", %s %s" % (output_format, getattr(exporter, "version", ""))
+    if options:
+        for name in sorted(options):
+            tools += ", %s=%r" % (name, options[name])
+    return tools
+
+class BuildState:
+    """Remembers how every output of earlier batch runs was made: from which
+    input, with its mtime, size and hash, and with which tools.
+
+    The state is kept in the output directory. Outputs are recorded relative
+    to it and inputs as absolute paths, so the state stays valid when
+    plunger runs from another directory.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.output_dir = os.path.dirname(path) or "."
+        self.entries = {}
+        if os.path.exists(path):
+            state_file = open(path)
+            try:
+                state = json.load(state_file)
+            finally:
+                state_file.close()
+            # states of older versions used paths relative to the directory
+            # plunger ran in, they can't be trusted
+            if state.get("version") == BUILD_STATE_VERSION:
+                self.entries = state["outputs"]
+
+    def save(self):
+        """Write the state to a temporary file and rename it into place
+        """
+        (fd, temp_path) = tempfile.mkstemp(prefix=BUILD_STATE_NAME,
+                dir=self.output_dir)
+        state_file = os.fdopen(fd, "w")
+        try:
+            json.dump({"version": BUILD_STATE_VERSION,
+                    "outputs": self.entries}, state_file, indent=0,
+                    sort_keys=True)
+        finally:
+            state_file.close()
+        os.rename(temp_path, self.path)
+
+    def getKey(self, output_asset):
+        """Get the path of output_asset relative to the output directory
+        """
+        return os.path.relpath(output_asset, self.output_dir)
+
+    def getPath(self, key):
+        """Get the path of a recorded output, or None if it is outside the
+        output directory
+        """
+        key = os.path.normpath(key)
+        if os.path.isabs(key) or key == os.pardir or \
+                key.startswith(os.pardir + os.sep):
+            return None
+        return os.path.join(self.output_dir, key)
+
+    def getOutputs(self):
+        """Get the keys of all recorded outputs, see getKey()
+        """
+        return self.entries.keys()
+
+    def isUpToDate(self, input_asset, output_asset, tools):
+        """Check if output_asset was made from the current content of
+        input_asset using the same tools. The input is only hashed if its
+        mtime changed but its size didn't.
+        """
+        entry = self.entries.get(self.getKey(output_asset))
+        if not entry or entry["input"] != os.path.abspath(input_asset) or \
+                entry["tools"] != tools or not os.path.exists(output_asset):
+            return False
+
+        try:
+            stat = os.stat(input_asset)
+        except OSError:
+            # the input is gone, let the conversion report it
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime == entry["mtime"]:
+            return True
+        if cache.hashFile(input_asset) != entry["hash"]:
+            return False
+        # touched, but not changed
+        entry["mtime"] = stat.st_mtime
+        return True
+
+    def update(self, input_asset, output_asset, tools):
+        stat = os.stat(input_asset)
+        self.entries[self.getKey(output_asset)] = {
+                "input": os.path.abspath(input_asset),
+                "mtime": stat.st_mtime, "size": stat.st_size,
+                "hash": cache.hashFile(input_asset), "tools": tools}
+
+    def remove(self, output_asset):
+        self.entries.pop(self.getKey(output_asset), None)
+
+def rebuild(jobs, input_format, output_format, state_path,
+        smoothing_angle=None, processes=None, cache_dir=None, transform=None):
+    """Like convertAll(), but only convert the jobs whose input or tools
+    changed since the last run recorded in state_path, and delete the
+    outputs of earlier runs that are not part of jobs anymore. Only outputs
+    in the directory of state_path are ever deleted.
+    Returns (results, number of up to date outputs, removed outputs).
+    """
+    state = BuildState(state_path)
+    tools = getTools(input_format, output_format,
+            core.getOptions(smoothing_angle, transform))
+
+    outputs = set([state.getKey(output_asset)
+            for (input_asset, output_asset) in jobs])
+    removed = []
+    for key in state.getOutputs():
+        if key in outputs:
+            continue
+        del state.entries[key]
+        output_asset = state.getPath(key)
+        if output_asset is None:
+            # not ours to delete
+            continue
+        try:
+            os.remove(output_asset)
+        except OSError:
+            # already gone
+            pass
+        removed.append(output_asset)
+
+    outdated = [(input_asset, output_asset)
+            for (input_asset, output_asset) in jobs
+            if not state.isUpToDate(input_asset, output_asset, tools)]
+    results = []
+    if outdated:
+        results = convertAll(outdated, input_format, output_format,
+                smoothing_angle, processes, cache_dir, transform)
+    for (input_asset, output_asset, error, seconds, cached) in results:
+        if error:
+            state.remove(output_asset)
+        else:
+            state.update(input_asset, output_asset, tools)
+    state.save()
+    return (results, len(jobs) - len(outdated), removed)
+
+def printReport(results, elapsed=None, out=sys.stdout, up_to_date=0,
+        removed=()):
+    """Print the outcome and time of every conversion and a summary.
+    For incremental rebuilds, the number of outputs that were up to date and
+    the removed outputs are reported, too.
+    """
+    failed = 0
+    cached = 0
+    for (input_asset, output_asset, error, seconds, from_cache) in results:
+        if error:
+            failed += 1
+            out.write("FAIL %7.2fs %s: %s\n" % (seconds, input_asset, error))
+        else:
+            status = "OK  "
+            if from_cache:
+                cached += 1
+                status = "HIT "
+            out.write("%s %7.2fs %s -> %s\n" % (status, seconds, input_asset,
+                output_asset))
+    summary = "%d converted, %d failed" % (len(results) - failed, failed)
+    for output_asset in removed:
+        out.write("DEL          %s\n" % output_asset)
+    if cached:
+        summary += ", %d from cache" % cached
+    if up_to_date:
+        summary += ", %d up to date" % up_to_date
+    if removed:
+        summary += ", %d removed" % len(removed)
+    if elapsed is not None:
+        summary += " in %.2fs" % elapsed
+    out.write(summary + "\n")
+    return failed
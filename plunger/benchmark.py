@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007 by Kai Blin
+#
+# Plunger is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""Benchmarks of the importers and exporters on synthetic meshes.
+
+Wavy grid meshes are generated at fixed scales, as a single mesh or split
+into several meshes, and written in every format that can be read back.
+Then the import of every format, the export to every format and the
+conversion between every pair of formats are timed. Each measurement runs
+in a fresh worker process, so the peak memory of one doesn't hide the next.
+
+The results are written as JSON, which can be compared to the results of an
+earlier run to catch regressions.
+"""
+
+import array
+import getopt
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    from plunger import batch
+    from plunger import core
+    from plunger import dom
+    from plunger import instrument
+    from plunger import registry
+except ImportError:
+    import batch
+    import core
+    import dom
+    import instrument
+    import registry
+
+# Number of triangles of the benchmark scales
+SCALES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+DEFAULT_SCALES = ["1k", "100k"]
+# Number of meshes of the benchmark shapes
+SHAPES = {"single": 1, "multi": 16}
+# Version of the result file layout
+RESULT_VERSION = 1
+
+def gridMesh(triangles, offset=0.0):
+    """Create a wavy square grid of about "triangles" triangles, with
+    normals and texture coordinates, shifted by offset along the x axis
+    """
+    cells = max(1, triangles // 2)
+    width = max(1, int(math.sqrt(cells)))
+    height = max(1, cells // width)
+    frequency = 8 * math.pi
+
+    positions = array.array(dom.FLOAT_TYPE)
+    normals = array.array(dom.FLOAT_TYPE)
+    uv_coords = array.array(dom.FLOAT_TYPE)
+    for j in xrange(height + 1):
+        v = float(j) / height
+        for i in xrange(width + 1):
+            u = float(i) / width
+            y = 0.05 * math.sin(frequency * u) * math.cos(frequency * v)
+            # y = f(x, z), so the normal is (-df/dx, 1, -df/dz)
+            dx = 0.05 * frequency * math.cos(frequency * u) * \
+                    math.cos(frequency * v)
+            dz = -0.05 * frequency * math.sin(frequency * u) * \
+                    math.sin(frequency * v)
+            length = math.sqrt(dx * dx + 1 + dz * dz)
+            positions.extend((u - 0.5 + offset, y, v - 0.5))
+            normals.extend((-dx / length, 1 / length, -dz / length))
+            uv_coords.extend((u, v))
+
+    indices = array.array(dom.INDEX_TYPE)
+    row = width + 1
+    for j in xrange(height):
+        for i in xrange(width):
+            a = j * row + i
+            indices.extend((a, a + row, a + 1, a + 1, a + row, a + row + 1))
+
+    mesh = dom.Mesh.fromArrays(positions, normals, uv_coords, indices)
+    mesh.materials = dom.Materials()
+    mesh.materials.parent = mesh
+    material = dom.Material()
+    material.parent = mesh.materials
+    material.path = "synthetic"
+    mesh.materials.materials.append(material)
+    return mesh
+
+def syntheticModel(triangles, num_meshes=1):
+    """Create a model of num_meshes grid meshes side by side, with about
+    "triangles" triangles in total
+    """
+    model = dom.Model()
+    model.meshes = dom.Meshes()
+    model.meshes.parent = model
+    for i in range(num_meshes):
+        mesh = gridMesh(triangles // num_meshes, offset=1.25 * i)
+        mesh.parent = model.meshes
+        model.meshes.meshes.append(mesh)
+    return model
+
+def formatArray(values):
+    return " ".join(["%g" % value for value in values])
+
+def writeCollada(path, model):
+    """Write the geometry of a model as a bare Collada document. The Collada
+    exporter only writes back models read from Collada files.
+    """
+    out = open(path, "w")
+    out.write('<?xml version="1.0"?>\n<COLLADA xmlns='
+            '"http://www.collada.org/2005/11/COLLADASchema" version="1.4.1">\n'
+            '<library_geometries>\n')
+    for (i, mesh) in enumerate(model.getMeshes()):
+        name = "mesh%d" % i
+        count = mesh.getNumVertices()
+        out.write('<geometry id="%s"><mesh>\n' % name)
+        for (source, values) in (("positions", mesh.positions),
+                ("normals", mesh.normals)):
+            out.write('<source id="%s-%s"><float_array id="%s-%s-array" '
+                    'count="%d">' % (name, source, name, source, len(values)))
+            out.write(formatArray(values))
+            out.write('</float_array><technique_common><accessor count="%d" '
+                    'source="#%s-%s-array" stride="3"><param name="X" '
+                    'type="float"/><param name="Y" type="float"/><param '
+                    'name="Z" type="float"/></accessor></technique_common>'
+                    '</source>\n' % (count, name, source))
+        out.write('<vertices id="%s-vertices"><input semantic="POSITION" '
+                'source="#%s-positions"/></vertices>\n' % (name, name))
+        out.write('<triangles count="%d"><input offset="0" semantic="VERTEX" '
+                'source="#%s-vertices"/><input offset="1" semantic="NORMAL" '
+                'source="#%s-normals"/>\n<p>' % (mesh.getNumFaces(), name,
+                name))
+        # the same index for the position and the normal of every corner
+        out.write(" ".join(["%d %d" % (index, index)
+                for index in mesh.indices]))
+        out.write('</p></triangles>\n</mesh></geometry>\n')
+    out.write('</library_geometries>\n</COLLADA>\n')
+    out.close()
+
+# Functions writing the synthetic assets of formats that need special care,
+# the exporters are used for all other formats
+ASSET_WRITERS = {"collada": writeCollada}
+
+def assetName(work_dir, scale, shape, format):
+    return os.path.join(work_dir, "synthetic-%s-%s%s" % (scale, shape,
+            batch.getExtension(format, registry.getExporter)))
+
+def getFormats(formats=None):
+    """Get the (import formats, export formats) to benchmark. Imports are
+    limited to formats that can be exported, as the inputs are generated.
+    """
+    import_formats = [format for format in sorted(core.getImportFormats())
+            if format in core.getExportFormats()]
+    export_formats = sorted(core.getExportFormats())
+    if formats:
+        import_formats = [f for f in import_formats if f in formats]
+        export_formats = [f for f in export_formats if f in formats]
+    return (import_formats, export_formats)
+
+def writeAssets(work_dir, scale, shape, formats):
+    """Write a synthetic model in all formats, unless it is there already.
+    Returns the formats that failed to export.
+    """
+    model = None
+    failed = []
+    for format in formats:
+        path = assetName(work_dir, scale, shape, format)
+        if os.path.exists(path):
+            continue
+        if model is None:
+            model = syntheticModel(SCALES[scale], SHAPES[shape])
+        writer = ASSET_WRITERS.get(format)
+        if writer:
+            result = callBenchmark(writer, (path, model))
+        else:
+            result = callBenchmark(core.exportAsset, (path, format, model))
+        if result:
+            failed.append(format)
+            if os.path.exists(path):
+                os.remove(path)
+    return failed
+
+def getCounters():
+    return (time.time(), time.clock(), instrument.getPeakMemory())
+
+def getMeasurement(start):
+    """Get the wall time, CPU time and peak memory growth since start
+    """
+    (wall, cpu, memory) = getCounters()
+    return {"wall": round(wall - start[0], 6), "cpu": round(cpu - start[1], 6),
+            "memory_kb": memory - start[2]}
+
+def benchImport(input_asset, input_format):
+    registry.getImporter(input_format)
+    start = getCounters()
+    conversion = core.Conversion()
+    conversion.importAsset(input_asset, input_format)
+    return getMeasurement(start)
+
+def benchExport(scale, shape, output_asset, output_format):
+    registry.getExporter(output_format)
+    model = syntheticModel(SCALES[scale], SHAPES[shape])
+    start = getCounters()
+    core.exportAsset(output_asset, output_format, model)
+    return getMeasurement(start)
+
+def benchConvert(input_asset, input_format, output_asset, output_format):
+    registry.getImporter(input_format)
+    registry.getExporter(output_format)
+    start = getCounters()
+    core.convert(input_asset, input_format, output_asset, output_format)
+    return getMeasurement(start)
+
+def callBenchmark(function, args):
+    """Call function(*args), turning errors and exits of plugins into an
+    {"error": message} result
+    """
+    try:
+        return function(*args)
+    except SystemExit, e:
+        return {"error": "exited with status %s" % e.code}
+    except Exception, e:
+        return {"error": "%s: %s" % (e.__class__.__name__, e)}
+
+def runIsolated(function, args):
+    """Call function(*args) in a fresh worker process
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(callBenchmark, (function, args))
+    finally:
+        pool.terminate()
+        pool.join()
+
+def measure(function, args, repeat=3):
+    """Run a benchmark "repeat" times, keep the best of every measurement
+    """
+    best = None
+    for i in range(repeat):
+        result = runIsolated(function, args)
+        if "error" in result:
+            return result
+        if best is None:
+            best = result
+            continue
+        for (name, value) in result.items():
+            best[name] = min(best[name], value)
+    return best
+
+def getBenchmarks(work_dir, scales, shapes, import_formats, export_formats):
+    """Get (name, description, function, args) of all benchmarks
+    """
+    output_dir = os.path.join(work_dir, "out")
+    benchmarks = []
+    for scale in scales:
+        for shape in shapes:
+            suffix = "%s %s" % (scale, shape)
+            description = {"scale": scale, "shape": shape,
+                    "triangles": SCALES[scale], "meshes": SHAPES[shape]}
+            for input_format in import_formats:
+                input_asset = assetName(work_dir, scale, shape, input_format)
+                benchmarks.append(("import %s %s" % (input_format, suffix),
+                        dict(description, operation="import",
+                        input_format=input_format), benchImport,
+                        (input_asset, input_format)))
+            for output_format in export_formats:
+                output_asset = assetName(output_dir, scale, shape,
+                        output_format)
+                benchmarks.append(("export %s %s" % (output_format, suffix),
+                        dict(description, operation="export",
+                        output_format=output_format), benchExport,
+                        (scale, shape, output_asset, output_format)))
+            for input_format in import_formats:
+                input_asset = assetName(work_dir, scale, shape, input_format)
+                for output_format in export_formats:
+                    output_asset = assetName(output_dir, scale, shape,
+                            output_format)
+                    benchmarks.append(("convert %s %s %s" % (input_format,
+                            output_format, suffix), dict(description,
+                            operation="convert", input_format=input_format,
+                            output_format=output_format), benchConvert,
+                            (input_asset, input_format, output_asset,
+                            output_format)))
+    return benchmarks
+
+def runBenchmarks(work_dir, scales=DEFAULT_SCALES, shapes=None,
+        formats=None, repeat=3, log=sys.stderr):
+    """Run all benchmarks, writing the synthetic assets to work_dir.
+    Returns the results, ready to be saved as JSON.
+    """
+    if not shapes:
+        shapes = sorted(SHAPES)
+    (import_formats, export_formats) = getFormats(formats)
+    output_dir = os.path.join(work_dir, "out")
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for scale in scales:
+        for shape in shapes:
+            log.write("writing %s %s assets\n" % (scale, shape))
+            for format in runIsolated(writeAssets, (work_dir, scale, shape,
+                    import_formats)):
+                log.write("can't write %s, not benchmarking its import\n" %
+                        format)
+                import_formats.remove(format)
+
+    results = {}
+    for (name, description, function, args) in getBenchmarks(work_dir,
+            scales, shapes, import_formats, export_formats):
+        result = measure(function, args, repeat)
+        result.update(description)
+        results[name] = result
+        if "error" in result:
+            log.write("%-40s FAIL %s\n" % (name, result["error"]))
+        else:
+            log.write("%-40s %8.3fs %8.3fs cpu %8d kB\n" % (name,
+                    result["wall"], result["cpu"], result["memory_kb"]))
+
+    return {"version": RESULT_VERSION, "plunger": core.VERSION,
+            "python": platform.python_version(), "machine": platform.node(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"), "repeat": repeat,
+            "results": results}
+
+def compareResults(old, new, threshold=0.1, out=sys.stdout):
+    """Print the wall time of every benchmark in both result sets and the
+    change. Returns the names of the benchmarks more than threshold slower.
+    """
+    regressions = []
+    for name in sorted(new["results"]):
+        if name not in old["results"] or "error" in new["results"][name] \
+                or "error" in old["results"][name]:
+            continue
+        old_wall = old["results"][name]["wall"]
+        new_wall = new["results"][name]["wall"]
+        change = 0.0
+        if old_wall:
+            change = new_wall / old_wall - 1
+        status = ""
+        if change > threshold:
+            status = "SLOWER"
+            regressions.append(name)
+        elif change < -threshold:
+            status = "faster"
+        out.write("%-40s %8.3fs %8.3fs %+7.1f%% %s\n" % (name, old_wall,
+                new_wall, change * 100, status))
+    return regressions
+
+def usage():
+    """Print the usage.
+    """
+    print """Usage: benchmark.py [options] [result file]
+Possible options are:
+--help              -h          Display this help text.
+--scales=<list>     -s <list>   Comma separated scales out of %s.
+                                [default: %s]
+--shapes=<list>                 Comma separated shapes out of %s.
+                                [default: all]
+--formats=<list>    -f <list>   Only benchmark the formats in <list>.
+                                [default: all]
+--repeat=<count>    -r <count>  Keep the best of <count> runs. [default: 3]
+--work-dir=<dir>    -w <dir>    Keep the synthetic assets in <dir> instead of
+                                a temporary directory.
+--compare=<file>    -c <file>   Compare with the results in <file>, exit
+                                with status 1 on regressions.
+--threshold=<percent>           Slowdown counted as regression. [default: 10]
+""" % (", ".join(sorted(SCALES)), ",".join(DEFAULT_SCALES),
+        ", ".join(sorted(SHAPES)))
+
+def main(argv):
+    scales = DEFAULT_SCALES
+    shapes = None
+    formats = None
+    repeat = 3
+    work_dir = None
+    compare_path = None
+    threshold = 10.0
+
+    try:
+        opts, args = getopt.getopt(argv, "hs:f:r:w:c:",
+            ["help", "scales=", "shapes=", "formats=", "repeat=",
+             "work-dir=", "compare=", "threshold="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif opt in ("-s", "--scales"):
+                scales = arg.split(",")
+                for scale in scales:
+                    if scale not in SCALES:
+                        raise ValueError("unknown scale '%s'" % scale)
+            elif opt == "--shapes":
+                shapes = arg.split(",")
+                for shape in shapes:
+                    if shape not in SHAPES:
+                        raise ValueError("unknown shape '%s'" % shape)
+            elif opt in ("-f", "--formats"):
+                formats = arg.split(",")
+            elif opt in ("-r", "--repeat"):
+                repeat = int(arg)
+            elif opt in ("-w", "--work-dir"):
+                work_dir = arg
+            elif opt in ("-c", "--compare"):
+                compare_path = arg
+            elif opt == "--threshold":
+                threshold = float(arg)
+    except (getopt.GetoptError, ValueError), e:
+        print "Error, %s." % e
+        usage()
+        sys.exit(2)
+
+    core.loadPlugins()
+
+    temp_dir = None
+    if not work_dir:
+        temp_dir = work_dir = tempfile.mkdtemp(prefix="plunger-bench")
+    try:
+        results = runBenchmarks(work_dir, scales, shapes, formats, repeat)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+    out = sys.stdout
+    if args:
+        out = open(args[0], "w")
+    json.dump(results, out, indent=1, sort_keys=True)
+    out.write("\n")
+    if args:
+        out.close()
+
+    if compare_path:
+        old_file = open(compare_path)
+        try:
+            old = json.load(old_file)
+        finally:
+            old_file.close()
+        if compareResults(old, results, threshold / 100, sys.stderr):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007 by Kai Blin
+#
+# Plunger is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""A content addressed cache of conversion results.
+
+Outputs are stored under a key derived from the input bytes, the formats,
+the versions of the plugins involved and the conversion options, so a
+conversion of an unchanged asset can be answered by copying the stored
+output instead of parsing the input again.
+
+Several processes can share a cache directory. Entries are written to a
+temporary file and renamed into place, and the least recently used entries
+are evicted once the cache grows beyond its size limit.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import registry
+import toolbox
+
+# Bump this if the way keys are built or entries are stored changes
+CACHE_VERSION = "2"
+# Default size limit of the cache, in bytes
+DEFAULT_MAX_SIZE = 1 << 30
+# Amount of input read at a time while hashing, in bytes
+HASH_CHUNK_SIZE = 1 << 20
+# Once the cache is too large, it is shrunk to this fraction of its size
+# limit, so the directory isn't read again on the next store
+EVICT_TARGET = 0.9
+# Prefix of entries that are still being written
+TEMP_PREFIX = ".tmp"
+
+def hashFile(path):
+    """Get the SHA-1 of a file's content, read chunk by chunk
+    """
+    digest = hashlib.sha1()
+    stream = open(path, "rb")
+    try:
+        chunk = stream.read(HASH_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = stream.read(HASH_CHUNK_SIZE)
+    finally:
+        stream.close()
+    return digest.hexdigest()
+
+class ConversionCache:
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # running total of the entry sizes, read from the directory on the
+        # first store() and only again once it passes max_size
+        self.size = None
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir(cache_dir):
+                    raise
+
+    def canCache(self, input_asset, output_asset):
+        """Only conversions from a local file to a local file can be cached
+        """
+        return isinstance(input_asset, basestring) and \
+                isinstance(output_asset, basestring) and \
+                input_asset != "-" and output_asset != "-" and \
+                os.path.isfile(input_asset)
+
+    def makeKey(self, input_asset, input_format, output_format, options=None,
+            output_asset=None):
+        """Get the key of converting input_asset with the given options. The
+        compression of output_asset, taken from its extension, is part of it.
+        """
+        importer = registry.getImporter(input_format)
+        exporter = registry.getExporter(output_format)
+        compression = None
+        if output_asset is not None:
+            compression = toolbox.getCompression(name=output_asset)
+        parts = [CACHE_VERSION, hashFile(input_asset),
+                input_format, getattr(importer, "version", ""),
+                output_format, getattr(exporter, "version", ""),
+                compression or ""]
+        if options:
+            for name in sorted(options):
+                parts.append("%s=%r" % (name, options[name]))
+        return hashlib.sha1("\0".join(parts)).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def fetch(self, key, output_asset):
+        """Copy the output stored under key to output_asset. Returns False if
+        there is no such entry.
+        """
+        path = self.getPath(key)
+        try:
+            shutil.copyfile(path, output_asset)
+            # mark the entry as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            # missing, or evicted while we were copying it
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key, output_asset):
+        """Store a copy of output_asset under key. Outputs larger than the
+        whole cache are not stored.
+        """
+        size = os.path.getsize(output_asset)
+        if size > self.max_size:
+            return
+        if self.size is None:
+            self.size = self.getSize()
+        path = self.getPath(key)
+        (fd, temp_path) = tempfile.mkstemp(prefix=TEMP_PREFIX,
+                dir=self.cache_dir)
+        try:
+            os.close(fd)
+            shutil.copyfile(output_asset, temp_path)
+            # mkstemp only makes the file readable for us
+            os.chmod(temp_path, 0644)
+            try:
+                # replaced by the new entry
+                self.size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.rename(temp_path, path)
+        except:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self.size += size
+        self.evict()
+
+    def getEntries(self):
+        """Get (mtime, size, path) of all complete entries
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(TEMP_PREFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def getSize(self):
+        return sum([size for (mtime, size, path) in self.getEntries()])
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits into
+        max_size again, with room to spare, see EVICT_TARGET. The directory
+        is only read if the running total, which misses entries stored by
+        other processes, passes max_size.
+        """
+        if self.size is not None and self.size <= self.max_size:
+            return
+        entries = self.getEntries()
+        size = sum([entry[1] for entry in entries])
+        self.size = size
+        if size <= self.max_size:
+            return
+        entries.sort()
+        target = self.max_size * EVICT_TARGET
+        for (mtime, entry_size, path) in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                # already removed by another process
+                pass
+            size -= entry_size
+        self.size = size
+
+    def getStats(self):
+        """Get the hit, miss and eviction counters of this cache object
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
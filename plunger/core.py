@@ -19,10 +19,258 @@
 Used to provide separation from the text user interface
 """
 
+import copy
+import os
+
 import registry
 import dom
+import instrument
+import normals
+
+VERSION = "0.1.0"
 
+# Model used by the module level importAsset()/exportAsset() functions
 model = dom.getModel()
+# Model of Conversion.exportAll() in its worker processes, see initShared()
+shared_model = None
+
+class Conversion:
+    """A conversion owning its own model, so several conversions can run in
+    one process, one after the other or in parallel threads.
+    """
+    def __init__(self):
+        self.model = dom.Model()
+        # set if the output was taken from a cache
+        self.cached = False
+        # stream meshes from the importer to the exporter if both can
+        self.streaming = True
+        # set if the meshes were streamed instead of kept in the model
+        self.streamed = False
+
+    def importAsset(self, input_asset, input_format):
+        importer = registry.getImporter(input_format)
+        with instrument.span("import") as span:
+            importer.importAsset(self.model, input_asset)
+            span.countMeshes(self.model.getMeshes())
+
+    def exportAsset(self, output_asset, output_format):
+        exporter = registry.getExporter(output_format)
+        with instrument.span("export"):
+            exportModel(exporter, self.model, output_asset)
+
+    def transform(self, transform):
+        """Apply a transform.Transform to all meshes
+        """
+        with instrument.span("transform"):
+            transform.apply(self.model)
+
+    def generateNormals(self, weighting=normals.WEIGHT_AREA,
+            smoothing_angle=None):
+        """Regenerate the normals of all meshes from their geometry
+        """
+        with instrument.span("normals") as span:
+            for mesh in self.model.getMeshes():
+                normals.generateNormals(mesh, weighting, smoothing_angle)
+            span.countMeshes(self.model.getMeshes())
+
+    def canStream(self, input_format, output_format, transform=None):
+        """Check if the meshes can be handed from the importer to the exporter
+        one at a time
+        """
+        importer = registry.getImporter(input_format)
+        exporter = registry.getExporter(output_format)
+        return self.streaming and hasattr(importer, "importMeshes") and \
+                hasattr(exporter, "exportMeshes") and \
+                not (transform and transform.needsModel())
+
+    def processMeshes(self, meshes, smoothing_angle=None, transform=None):
+        """Transform and regenerate the normals of meshes as they pass by
+        """
+        for mesh in meshes:
+            if transform:
+                with instrument.span("transform"):
+                    transform.applyMesh(mesh)
+            if smoothing_angle is not None:
+                with instrument.span("normals") as span:
+                    normals.generateNormals(mesh,
+                            smoothing_angle=smoothing_angle)
+                    span.countMeshes([mesh])
+            yield mesh
+
+    def streamAsset(self, input_asset, input_format, output_asset,
+            output_format, smoothing_angle=None, transform=None):
+        """Convert mesh by mesh. The meshes are not kept in the model.
+        """
+        importer = registry.getImporter(input_format)
+        exporter = registry.getExporter(output_format)
+        meshes = self.processMeshes(importer.importMeshes(input_asset),
+                smoothing_angle, transform)
+        try:
+            with instrument.span("stream"):
+                exporter.exportMeshes(meshes, output_asset)
+        except:
+            # the output is opened before the input is read, don't leave
+            # half of it behind if the input turns out to be broken
+            removeOutput(output_asset)
+            raise
+        self.streamed = True
+
+    def convert(self, input_asset, input_format, output_asset, output_format,
+            smoothing_angle=None, cache=None, transform=None):
+        with instrument.record(input=input_asset, input_format=input_format,
+                output=output_asset, output_format=output_format):
+            self.doConvert(input_asset, input_format, output_asset,
+                    output_format, smoothing_angle, cache, transform)
+
+    def doConvert(self, input_asset, input_format, output_asset,
+            output_format, smoothing_angle=None, cache=None, transform=None):
+        key = None
+        if cache and cache.canCache(input_asset, output_asset):
+            with instrument.span("cache") as span:
+                key = cache.makeKey(input_asset, input_format, output_format,
+                        getOptions(smoothing_angle, transform), output_asset)
+                self.cached = cache.fetch(key, output_asset)
+                span.count(hits=int(self.cached))
+            if self.cached:
+                return
+
+        if self.canStream(input_format, output_format, transform):
+            self.streamAsset(input_asset, input_format, output_asset,
+                    output_format, smoothing_angle, transform)
+        else:
+            self.importAsset(input_asset, input_format)
+            if transform:
+                self.transform(transform)
+            if smoothing_angle is not None:
+                self.generateNormals(smoothing_angle=smoothing_angle)
+            self.exportAsset(output_asset, output_format)
+
+        if key and os.path.isfile(output_asset):
+            with instrument.span("cache store"):
+                cache.store(key, output_asset)
+
+    def exportAll(self, outputs, processes=None):
+        """Export the model to all (output_asset, output_format) pairs in
+        outputs, on "processes" worker processes, one per core by default.
+        Every exporter gets its own snapshot of the model, so none of them
+        sees changes made by another. Returns an error message or None for
+        every output.
+        """
+        import multiprocessing
+        if not processes:
+            processes = multiprocessing.cpu_count()
+        processes = min(processes, len(outputs))
+
+        if processes <= 1:
+            return [exportSnapshot(copy.deepcopy(self.model), output)
+                    for output in outputs]
+
+        # every job gets a fresh worker, forked from the untouched model,
+        # which the forked initializer gets without pickling it
+        pool = multiprocessing.Pool(processes, initShared, (self.model,),
+                maxtasksperchild=1)
+        try:
+            results = pool.map(exportShared, outputs, chunksize=1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        pool.join()
+        return results
+
+    def convertToAll(self, input_asset, input_format, outputs,
+            smoothing_angle=None, cache=None, transform=None,
+            processes=None):
+        """Import an asset once and export it to all (output_asset,
+        output_format) pairs in outputs at the same time, see exportAll().
+        Outputs found in the cache are copied from it, the input is only
+        imported if any output is missing.
+        """
+        with instrument.record(input=input_asset, input_format=input_format,
+                output=" ".join([output for (output, format) in outputs]),
+                output_format=" ".join([format
+                for (output, format) in outputs])):
+            return self.doConvertToAll(input_asset, input_format, outputs,
+                    smoothing_angle, cache, transform, processes)
+
+    def doConvertToAll(self, input_asset, input_format, outputs,
+            smoothing_angle=None, cache=None, transform=None,
+            processes=None):
+        errors = {}
+        keys = {}
+        missing = []
+        with instrument.span("cache") as span:
+            for (output_asset, output_format) in outputs:
+                if cache and cache.canCache(input_asset, output_asset):
+                    key = cache.makeKey(input_asset, input_format,
+                            output_format,
+                            getOptions(smoothing_angle, transform),
+                            output_asset)
+                    if cache.fetch(key, output_asset):
+                        errors[output_asset] = None
+                        span.count(hits=1)
+                        continue
+                    keys[output_asset] = key
+                missing.append((output_asset, output_format))
+
+        self.cached = not missing
+        if missing:
+            self.importAsset(input_asset, input_format)
+            if transform:
+                self.transform(transform)
+            if smoothing_angle is not None:
+                self.generateNormals(smoothing_angle=smoothing_angle)
+            with instrument.span("export all"):
+                results = self.exportAll(missing, processes)
+            for ((output_asset, output_format), error) in zip(missing,
+                    results):
+                errors[output_asset] = error
+                if not error and output_asset in keys and \
+                        os.path.isfile(output_asset):
+                    cache.store(keys[output_asset], output_asset)
+
+        return [errors[output_asset] for (output_asset, output_format)
+                in outputs]
+
+def exportSnapshot(snapshot, output):
+    """Export a model to an (output_asset, output_format) pair. Returns None
+    on success, the error message otherwise.
+    """
+    (output_asset, output_format) = output
+    try:
+        exporter = registry.getExporter(output_format)
+        with instrument.span("export"):
+            exportModel(exporter, snapshot, output_asset)
+    except SystemExit, e:
+        # plugins exit on errors they already reported
+        return "exited with status %s" % e.code
+    except Exception, e:
+        error = e.__class__.__name__
+        if str(e):
+            error += ": %s" % e
+        return error
+    return None
+
+def initShared(model):
+    """Keep the model of Conversion.exportAll() in a worker process. Only the
+    worker sets this, so conversions in parallel threads of the parent don't
+    share it.
+    """
+    global shared_model
+    shared_model = model
+
+def exportShared(output):
+    """Export the model of Conversion.exportAll() in a forked worker
+    """
+    return exportSnapshot(shared_model, output)
+
+def getOptions(smoothing_angle=None, transform=None):
+    """Get the options of a conversion that change its output, as a dict
+    """
+    options = {"smoothing_angle": smoothing_angle}
+    if transform and not transform.isIdentity():
+        options["transform"] = transform.describe()
+    return options
 
 def loadPlugins(plugindir="plugins"):
     registry.loadPlugins(plugindir)
@@ -33,15 +281,53 @@ def getImportFormats():
 def getExportFormats():
     return registry.getExportFormats()
 
-def importAsset(input_asset, input_format):
+def importAsset(input_asset, input_format, model=model):
     importer = registry.getImporter(input_format)
     importer.importAsset(model, input_asset)
 
-def exportAsset(output_asset, output_format):
+def exportAsset(output_asset, output_format, model=model):
     exporter = registry.getExporter(output_format)
-    exporter.exportAsset(model, output_asset)
+    exportModel(exporter, model, output_asset)
+
+def exportModel(exporter, model, output_asset):
+    """Export a model, removing the output if the exporter fails. Exporters
+    open their output before generating it, so it would be left behind empty
+    or half written.
+    """
+    try:
+        exporter.exportAsset(model, output_asset)
+    except:
+        removeOutput(output_asset)
+        raise
+
+def removeOutput(output_asset):
+    """Remove the output file of a failed conversion, if there is one
+    """
+    if isinstance(output_asset, basestring) and output_asset != "-" and \
+            os.path.isfile(output_asset):
+        os.remove(output_asset)
 
-def convert(input_asset, input_format, output_asset, output_format):
-    importAsset(input_asset, input_format)
-    exportAsset(output_asset, output_format)
+def convert(input_asset, input_format, output_asset, output_format,
+        smoothing_angle=None, cache=None, transform=None):
+    """Convert an asset using a fresh model, safe to call concurrently.
+    If a transform.Transform is given, it is applied to all meshes first.
+    If smoothing_angle is given, normals are regenerated and vertices on
+    edges sharper than smoothing_angle degrees are split.
+    If a ConversionCache is given, unchanged assets are copied from it
+    instead of being converted again.
+    """
+    conversion = Conversion()
+    conversion.convert(input_asset, input_format, output_asset, output_format,
+            smoothing_angle, cache, transform)
+    return conversion
 
+def convertToAll(input_asset, input_format, outputs, smoothing_angle=None,
+        cache=None, transform=None, processes=None):
+    """Convert an asset to all (output_asset, output_format) pairs in
+    outputs, importing it only once. The exports run in parallel on
+    "processes" worker processes. Returns an error message or None for
+    every output.
+    """
+    conversion = Conversion()
+    return conversion.convertToAll(input_asset, input_format, outputs,
+            smoothing_angle, cache, transform, processes)
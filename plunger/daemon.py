@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007 by Kai Blin
+#
+# Plunger is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""A conversion daemon listening on a Unix domain socket, and its client.
+
+The daemon keeps a pool of worker processes with all plugins loaded. Every
+connection carries one job: a JSON header line with the formats and the
+input and output paths, followed by the raw input if no input path is
+given. The connection is handed to a worker, which reads the input and
+sends back the output while it converts, if no output path was given.
+Input and output are sent as chunks, each a line with its size in hex and
+that many bytes, ended by an empty chunk. The answer ends with a JSON line
+with the status. Every job is converted with its own model, so concurrent
+jobs don't interfere.
+
+Only the standard library is imported up front, so the client starts fast.
+"""
+
+import errno
+import json
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+
+# Directory of the socket if there is no $XDG_RUNTIME_DIR, only its owner
+# may access it
+PRIVATE_DIR = "/tmp/plunger-%s" % os.getuid()
+
+def getDefaultSocket():
+    """Get the socket used if none is given: $PLUNGER_SOCKET, plunger.sock
+    in $XDG_RUNTIME_DIR, or in PRIVATE_DIR
+    """
+    if os.environ.get("PLUNGER_SOCKET"):
+        return os.environ["PLUNGER_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "plunger.sock")
+    return os.path.join(PRIVATE_DIR, "plunger.sock")
+
+DEFAULT_SOCKET = getDefaultSocket()
+# Amount of data sent in one chunk, in bytes
+CHUNK_SIZE = 1 << 16
+
+def writeHeader(out, header):
+    """Write a header line to a stream
+    """
+    out.write(json.dumps(header) + "\n")
+    out.flush()
+
+def readHeader(stream):
+    """Read a header line from a stream. Raises EOFError if the stream ended
+    and ValueError if the header is broken.
+    """
+    line = stream.readline()
+    if not line:
+        raise EOFError
+    header = json.loads(line)
+    if not isinstance(header, dict):
+        raise ValueError("header is not an object")
+    return header
+
+def writeChunk(out, data):
+    """Write a chunk of payload to a stream, an empty chunk ends the payload
+    """
+    out.write("%x\n" % len(data))
+    out.write(data)
+
+class ChunkedReader:
+    """Read a payload sent in chunks from a stream, as if it was a file
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        # bytes left in the current chunk
+        self.remaining = 0
+        self.eof = False
+
+    def nextChunk(self):
+        line = self.stream.readline()
+        if not line:
+            raise EOFError
+        self.remaining = int(line, 16)
+        if not self.remaining:
+            self.eof = True
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        chunks = []
+        while not self.eof and size != 0:
+            if not self.remaining:
+                self.nextChunk()
+                continue
+            count = self.remaining
+            if size > 0:
+                count = min(count, size)
+                size -= count
+            data = self.stream.read(count)
+            if len(data) != count:
+                raise EOFError
+            chunks.append(data)
+            self.remaining -= count
+        return "".join(chunks)
+
+    def skip(self):
+        """Skip the rest of the payload
+        """
+        while not self.eof:
+            self.read(CHUNK_SIZE)
+
+    def close(self):
+        pass
+
+class ChunkedWriter:
+    """Send everything written to it as chunks of about CHUNK_SIZE bytes.
+    close() ends the payload, but not the stream.
+    """
+    def __init__(self, out):
+        self.out = out
+        self.buffer = []
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.size:
+            writeChunk(self.out, "".join(self.buffer))
+            self.buffer = []
+            self.size = 0
+        self.out.flush()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            writeChunk(self.out, "")
+            self.out.flush()
+            self.closed = True
+
+def copyPayload(stream, out):
+    """Copy a payload sent in chunks from stream to out, chunk by chunk
+    """
+    reader = ChunkedReader(stream)
+    while True:
+        chunk = reader.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        out.write(chunk)
+        out.flush()
+
+def sendPayload(source, out):
+    """Send everything read from source to out in chunks, then end the
+    payload
+    """
+    writer = ChunkedWriter(out)
+    while True:
+        data = source.read(CHUNK_SIZE)
+        if not data:
+            break
+        writer.write(data)
+    writer.close()
+
+def initWorker(profile_path=None):
+    """Load all plugins once per worker
+    """
+    try:
+        from plunger import core
+        from plunger import instrument
+        from plunger import registry
+    except ImportError:
+        import core
+        import instrument
+        import registry
+    instrument.enable(profile_path)
+    core.loadPlugins()
+    for format in registry.getImportFormats():
+        registry.getImporter(format)
+    for format in registry.getExportFormats():
+        registry.getExporter(format)
+
+def runJob(job, handle):
+    """Convert a job in a worker, reading the input from and sending the
+    output to the client connection passed as the reduced "handle". Returns
+    None if the conversion worked, the error message otherwise.
+    """
+    from multiprocessing import reduction
+    fd = reduction.rebuild_handle(handle)
+    sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(fd)
+    rfile = sock.makefile("rb")
+    wfile = sock.makefile("wb")
+    try:
+        return convertJob(job, rfile, wfile)
+    finally:
+        try:
+            wfile.close()
+        except socket.error:
+            # the client went away
+            pass
+        rfile.close()
+        sock.close()
+
+def convertJob(job, rfile, wfile):
+    """Convert a job, see runJob()
+    """
+    try:
+        from plunger import core
+        from plunger import registry
+        from plunger import transform
+    except ImportError:
+        import core
+        import registry
+        import transform
+
+    geometry_transform = None
+    if job.get("transform"):
+        geometry_transform = transform.Transform()
+        geometry_transform.recenter = job["transform"]["recenter"]
+        geometry_transform.unit_scale = job["transform"]["unit_scale"]
+        geometry_transform.matrix = job["transform"]["matrix"]
+
+    reader = None
+    input_asset = job.get("input")
+    if input_asset is None:
+        input_asset = reader = ChunkedReader(rfile)
+    else:
+        input_asset = str(input_asset)
+    output_asset = job.get("output")
+    if output_asset is None:
+        output_asset = ChunkedWriter(wfile)
+    else:
+        output_asset = str(output_asset)
+
+    try:
+        try:
+            input_format = job.get("input_format")
+            if input_format:
+                input_format = str(input_format)
+            else:
+                (input_format, input_asset) = registry.detectFormat(
+                        input_asset)
+                if input_format is None:
+                    return "can't detect the input format"
+            core.convert(input_asset, input_format, output_asset,
+                    str(job.get("output_format", "info")),
+                    job.get("smoothing_angle"), None, geometry_transform)
+        except SystemExit, e:
+            # plugins exit on errors they already reported
+            return "conversion exited with status %s" % e.code
+        except Exception, e:
+            error = e.__class__.__name__
+            if str(e):
+                error += ": %s" % e
+            return error
+    finally:
+        # the status is only sent after the end of the output, and the rest
+        # of the input has to be read so the client can finish sending it
+        try:
+            if reader:
+                reader.skip()
+            if job.get("output") is None:
+                output_asset.close()
+            else:
+                writeChunk(wfile, "")
+        except (EOFError, ValueError, socket.error):
+            # the client went away
+            pass
+    return None
+
+class JobHandler(SocketServer.StreamRequestHandler):
+    # read the header without buffering, the worker reads what follows
+    rbufsize = 0
+
+    def handle(self):
+        from multiprocessing import reduction
+        try:
+            job = readHeader(self.rfile)
+        except (EOFError, ValueError), e:
+            writeChunk(self.wfile, "")
+            writeHeader(self.wfile, {"status": "error",
+                "message": "invalid job"})
+            return
+
+        handle = reduction.reduce_handle(self.connection.fileno())
+        error = self.server.pool.apply(runJob, (job, handle))
+        try:
+            if error:
+                writeHeader(self.wfile, {"status": "error",
+                    "message": error})
+            else:
+                writeHeader(self.wfile, {"status": "ok"})
+        except socket.error:
+            # the client went away
+            pass
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+class ConversionServer(SocketServer.ThreadingMixIn,
+        SocketServer.UnixStreamServer):
+    """Accepts jobs on a Unix socket and converts them on a pool of
+    "processes" warm workers, one per core by default.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, processes=None,
+            profile_path=None):
+        if os.path.dirname(socket_path) == PRIVATE_DIR:
+            makePrivateDir(PRIVATE_DIR)
+        if os.path.exists(socket_path):
+            if isListening(socket_path):
+                raise IOError("a daemon is already listening on '%s'" %
+                        socket_path)
+            # left over from a daemon that died
+            os.remove(socket_path)
+
+        # start the workers first, so they don't inherit the socket
+        import multiprocessing
+        self.pool = multiprocessing.Pool(processes, initWorker,
+                (profile_path,))
+        self.socket_path = socket_path
+        SocketServer.UnixStreamServer.__init__(self, socket_path, JobHandler)
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+        # only the owner may submit jobs
+        os.chmod(self.server_address, 0600)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+def makePrivateDir(path):
+    """Create a directory only its owner can access, or make sure an
+    existing one is such a directory owned by the current user
+    """
+    try:
+        os.mkdir(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            stat.S_IMODE(info.st_mode) & 077:
+        raise IOError("'%s' is not a private directory of the current user"
+                % path)
+
+def checkOwner(socket_path):
+    """Make sure socket_path belongs to the current user, so jobs aren't
+    sent to a socket someone else created
+    """
+    if os.stat(socket_path).st_uid != os.getuid():
+        raise IOError("'%s' belongs to another user" % socket_path)
+
+def isListening(socket_path):
+    """Check if a daemon accepts connections on socket_path
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error:
+            return False
+        return True
+    finally:
+        sock.close()
+
+def stopServing(signum, frame):
+    raise KeyboardInterrupt
+
+def serve(socket_path=DEFAULT_SOCKET, processes=None, profile_path=None):
+    """Run a daemon until it is interrupted or terminated. If profile_path
+    is given, the workers append the profile of every job to it.
+    """
+    server = ConversionServer(socket_path, processes, profile_path)
+    # the workers keep the default handler, terminate() has to stop them
+    signal.signal(signal.SIGTERM, stopServing)
+    try:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.server_close()
+
+def submit(input_asset, input_format, output_asset, output_format,
+        smoothing_angle=None, socket_path=DEFAULT_SOCKET, transform=None):
+    """Hand a conversion to the daemon at socket_path, like core.convert().
+    Paths are passed on, the input is streamed over the socket if it is "-"
+    or a stream, and the output is streamed back while it is converted if it
+    is "-" or a stream.
+    Returns None if the conversion worked, the error message otherwise.
+    """
+    job = {"input_format": input_format, "output_format": output_format,
+            "smoothing_angle": smoothing_angle}
+    if transform and not transform.isIdentity():
+        job["transform"] = {"recenter": transform.recenter,
+                "unit_scale": transform.unit_scale,
+                "matrix": transform.matrix}
+    source = None
+    if input_asset == "-":
+        source = sys.stdin
+    elif hasattr(input_asset, "read"):
+        source = input_asset
+    elif os.path.exists(input_asset):
+        # the daemon runs in a different directory
+        job["input"] = os.path.abspath(input_asset)
+    else:
+        job["input"] = input_asset
+
+    out = None
+    if output_asset == "-":
+        out = sys.stdout
+    elif hasattr(output_asset, "write"):
+        out = output_asset
+    else:
+        job["output"] = os.path.abspath(output_asset)
+
+    checkOwner(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    rfile = sock.makefile("rb")
+    wfile = sock.makefile("wb")
+    sender = None
+    try:
+        writeHeader(wfile, job)
+        if source:
+            # send the input while the output comes back
+            import threading
+            sender = threading.Thread(target=sendInput, args=(source, wfile))
+            sender.daemon = True
+            sender.start()
+        if out:
+            copyPayload(rfile, out)
+        else:
+            ChunkedReader(rfile).skip()
+        header = readHeader(rfile)
+        if header.get("status") != "ok":
+            return header.get("message", "unknown error")
+    finally:
+        if sender:
+            sender.join()
+        rfile.close()
+        wfile.close()
+        sock.close()
+    return None
+
+def sendInput(source, out):
+    """Send the input of a job, in a thread of its own
+    """
+    try:
+        sendPayload(source, out)
+    except socket.error:
+        # the daemon gave up on the job
+        pass
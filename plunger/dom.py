@@ -18,6 +18,12 @@
 """The Plunger Document Object Model, based on the Collada DOM
 """
 
+import array
+
+# Typecodes of the packed mesh buffers, float32 and uint32
+FLOAT_TYPE = 'f'
+INDEX_TYPE = 'I'
+
 model = None
 
 def getModel():
@@ -26,6 +32,20 @@ def getModel():
         model = Model()
     return model
 
+def toFloatArray(values):
+    """Convert a sequence of numbers to a float32 array, unless it is one
+    """
+    if isinstance(values, array.array) and values.typecode == FLOAT_TYPE:
+        return values
+    return array.array(FLOAT_TYPE, values)
+
+def toIndexArray(values):
+    """Convert a sequence of numbers to an uint32 array, unless it is one
+    """
+    if isinstance(values, array.array) and values.typecode == INDEX_TYPE:
+        return values
+    return array.array(INDEX_TYPE, values)
+
 class PlungerNode:
     def __init__(self):
         self.parent = None
@@ -86,31 +106,55 @@ class Meshes(PlungerNode):
         return self.meshes
 
 class Mesh(PlungerNode):
+    """A mesh keeps its geometry in packed, contiguous buffers.
+
+    positions and normals hold three float32 values per vertex, uv_coords two,
+    indices three uint32 values per triangle. face_normals is optional and
+    holds three float32 values per triangle.
+    Vertices and Faces only are views into these buffers.
+    """
     def __init__(self):
         PlungerNode.__init__(self)
-        self.faces = None
-        self.vertices = None
+        self.positions = array.array(FLOAT_TYPE)
+        self.normals = array.array(FLOAT_TYPE)
+        self.uv_coords = array.array(FLOAT_TYPE)
+        self.indices = array.array(INDEX_TYPE)
+        self.face_normals = array.array(FLOAT_TYPE)
+        self.faces = Faces(self)
+        self.vertices = Vertices(self)
         self.materials = None
 
+    @classmethod
+    def fromArrays(cls, positions, normals=None, uv_coords=None, indices=None):
+        """Create a mesh from flat sequences of vertex and index data.
+        Arrays of the right type are used as they are, without copying.
+        """
+        mesh = cls()
+        mesh.positions = toFloatArray(positions)
+        if normals:
+            mesh.normals = toFloatArray(normals)
+        if uv_coords:
+            mesh.uv_coords = toFloatArray(uv_coords)
+        if indices:
+            mesh.indices = toIndexArray(indices)
+        return mesh
+
+    def toArrays(self):
+        """Return the (positions, normals, uv_coords, indices) buffers
+        """
+        return (self.positions, self.normals, self.uv_coords, self.indices)
+
     def getNumFaces(self):
-        if self.faces:
-            return self.faces.getNumFaces()
-        return 0
+        return len(self.indices) // 3
 
     def getFaces(self):
-        if self.faces:
-            return self.faces.getFaces()
-        return []
+        return self.faces.getFaces()
 
     def getNumVertices(self):
-        if self.vertices:
-            return self.vertices.getNumVertices()
-        return 0
+        return len(self.positions) // 3
 
     def getVertices(self):
-        if self.vertices:
-            return self.vertices.getVertices()
-        return []
+        return self.vertices.getVertices()
 
     def getNumMaterials(self):
         if self.materials:
@@ -122,29 +166,65 @@ class Mesh(PlungerNode):
             return self.materials.getMaterials()
         return []
 
+class ElementList(object):
+    """Read-only sequence over the elements of a mesh buffer.
+    Element objects are only created when they are accessed.
+    """
+    __slots__ = ("mesh", "count_fun", "element_fun")
+
+    def __init__(self, mesh, count_fun, element_fun):
+        self.mesh = mesh
+        self.count_fun = count_fun
+        self.element_fun = element_fun
+
+    def __len__(self):
+        return self.count_fun(self.mesh)
+
+    def __getitem__(self, index):
+        count = self.count_fun(self.mesh)
+        if isinstance(index, slice):
+            return [self.element_fun(self.mesh, i) for i in
+                    xrange(*index.indices(count))]
+        if index < 0:
+            index += count
+        if index < 0 or index >= count:
+            raise IndexError("element index out of range")
+        return self.element_fun(self.mesh, index)
+
+    def __iter__(self):
+        for i in xrange(self.count_fun(self.mesh)):
+            yield self.element_fun(self.mesh, i)
+
 class Faces(PlungerNode):
-    def __init__(self):
+    """View of the triangles in a mesh's index buffer
+    """
+    def __init__(self, mesh):
         PlungerNode.__init__(self)
-        self.faces = []
-        self.count = 0
+        self.parent = mesh
+        self.faces = ElementList(mesh, Mesh.getNumFaces, Face)
+
+    def __len__(self):
+        return self.parent.getNumFaces()
 
     def getNumFaces(self):
-        self.count = len(self.faces)
-        return self.count
+        return self.parent.getNumFaces()
 
     def getFaces(self):
-        faces = []
-        for face in self.faces:
-            faces.append(face.getFace())
-        return faces
+        return ElementList(self.parent, Mesh.getNumFaces, getVertexList)
 
 class Vertices(PlungerNode):
-    def __init__(self):
+    """View of the vertices in a mesh's attribute buffers
+    """
+    def __init__(self, mesh):
         PlungerNode.__init__(self)
-        self.vertices = []
+        self.parent = mesh
+        self.vertices = ElementList(mesh, Mesh.getNumVertices, Vertex)
+
+    def __len__(self):
+        return self.parent.getNumVertices()
 
     def getNumVertices(self):
-        return len(self.vertices)
+        return self.parent.getNumVertices()
 
     def getVertices(self):
         return self.vertices
@@ -160,34 +240,55 @@ class Materials(PlungerNode):
     def getMaterials(self):
         return self.materials
 
-class Face(PlungerNode):
-    def __init__(self):
-        PlungerNode.__init__(self)
-        self.vertex_list = []
-        self.normals = []
+def getVertexList(mesh, index):
+    """Get the vertex indices of face "index" of the mesh as a list
+    """
+    return mesh.indices[index * 3:index * 3 + 3].tolist()
+
+class Face(object):
+    """Lightweight view of a single triangle of a mesh
+    """
+    __slots__ = ("mesh", "index")
+
+    def __init__(self, mesh, index):
+        self.mesh = mesh
+        self.index = index
+
+    def getType(self):
+        return self.__class__.__name__
 
     def getFace(self):
-        return self.vertex_list
+        return getVertexList(self.mesh, self.index)
 
     def getNormals(self):
-        return self.normals
+        i = self.index * 3
+        return self.mesh.face_normals[i:i+3].tolist()
 
-class Vertex(PlungerNode):
-    def __init__(self):
-        PlungerNode.__init__(self)
-        self.position = []
-        self.normals = []
-        self.uv_coords = []
+class Vertex(object):
+    """Lightweight view of a single vertex of a mesh
+    """
+    __slots__ = ("mesh", "index")
+
+    def __init__(self, mesh, index):
+        self.mesh = mesh
+        self.index = index
+
+    def getType(self):
+        return self.__class__.__name__
 
     def getPosition(self):
-        return self.position
+        i = self.index * 3
+        return self.mesh.positions[i:i+3].tolist()
 
     def getNormals(self):
-        return self.normals
+        i = self.index * 3
+        return self.mesh.normals[i:i+3].tolist()
 
     def getUVCoords(self):
-        if self.uv_coords:
-            return self.uv_coords
+        i = self.index * 2
+        uv_coords = self.mesh.uv_coords[i:i+2]
+        if uv_coords:
+            return uv_coords.tolist()
 
 class Material(PlungerNode):
     def __init__(self):
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007 by Kai Blin
+#
+# Plunger is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""Timing and memory instrumentation of the conversion stages.
+
+Stages are wrapped in spans:
+
+    with instrument.span("parse") as span:
+        ...
+        span.count(bytes=size)
+
+While no profile is recorded, span() returns a shared do-nothing span, so
+the instrumentation can stay in place at the cost of one function call per
+stage. Spans of the same name under the same parent are merged, so stages
+run once per mesh add up instead of piling up.
+
+Every profiled conversion is appended to the profile file as one line of
+JSON, which lets several worker processes share one file.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# The Profile being recorded by a thread is state.profile, if any
+state = threading.local()
+# File the profiles of conversions are appended to, None to not profile
+profile_path = None
+
+def getPeakMemory():
+    """Get the peak resident set size of the process, in kilobytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class NullSpan:
+    """The span handed out while instrumentation is off
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def count(self, **counts):
+        pass
+
+    def countMeshes(self, meshes):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    """Wall time, CPU time, growth of the peak memory and element counts of
+    one stage, with the spans of its sub-stages
+    """
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.memory_growth = 0
+        self.peak_memory = 0
+        self.counts = {}
+        self.children = []
+
+    def getChild(self, name):
+        for child in self.children:
+            if child.name == name:
+                return child
+        child = Span(self.profile, name)
+        self.children.append(child)
+        return child
+
+    def __enter__(self):
+        self.profile.stack.append(self)
+        self.calls += 1
+        self.start_memory = getPeakMemory()
+        self.start_cpu = time.clock()
+        self.start_wall = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall += time.time() - self.start_wall
+        self.cpu += time.clock() - self.start_cpu
+        self.peak_memory = getPeakMemory()
+        self.memory_growth += self.peak_memory - self.start_memory
+        self.profile.stack.pop()
+        return False
+
+    def count(self, **counts):
+        """Add to the element counts of the span
+        """
+        for (name, value) in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def countMeshes(self, meshes):
+        """Count the meshes, vertices and faces of a list of meshes
+        """
+        self.count(meshes=len(meshes),
+                vertices=sum([mesh.getNumVertices() for mesh in meshes]),
+                faces=sum([mesh.getNumFaces() for mesh in meshes]))
+
+    def toDict(self):
+        result = {"name": self.name, "calls": self.calls,
+                "wall": round(self.wall, 6), "cpu": round(self.cpu, 6),
+                "peak_memory_kb": self.peak_memory,
+                "memory_growth_kb": self.memory_growth}
+        if self.counts:
+            result["counts"] = self.counts
+        if self.children:
+            result["spans"] = [child.toDict() for child in self.children]
+        return result
+
+class Profile:
+    """The spans recorded for one conversion
+    """
+    def __init__(self, name):
+        self.stack = []
+        self.root = Span(self, name)
+
+    def span(self, name):
+        parent = self.root
+        if self.stack:
+            parent = self.stack[-1]
+        return parent.getChild(name)
+
+def span(name):
+    """Get the span for stage "name" below the current one
+    """
+    profile = getattr(state, "profile", None)
+    if profile is None:
+        return NULL_SPAN
+    return profile.span(name)
+
+def enable(path):
+    """Append a profile of every following conversion to "path", or write
+    it to stderr if path is "-"
+    """
+    global profile_path
+    profile_path = path
+
+class Recording:
+    """Record the profile of a conversion and append it to the profile file
+    """
+    def __init__(self, info):
+        self.info = info
+        self.span = NULL_SPAN
+
+    def __enter__(self):
+        if profile_path and getattr(state, "profile", None) is None:
+            state.profile = Profile("convert")
+            self.span = state.profile.root.__enter__()
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.span is NULL_SPAN:
+            return False
+        self.span.__exit__(exc_type, exc_value, traceback)
+        state.profile = None
+
+        record = dict(self.info)
+        record["pid"] = os.getpid()
+        record["failed"] = exc_type is not None
+        record.update(self.span.toDict())
+        line = json.dumps(record, sort_keys=True) + "\n"
+        if profile_path == "-":
+            sys.stderr.write(line)
+            return False
+        # one write per record, so concurrent appends don't interleave
+        fd = os.open(profile_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                0644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        return False
+
+def record(**info):
+    """Profile a conversion if a profile path is set. The keyword arguments
+    describe the conversion in the profile, assets that aren't file names
+    are described by their type.
+    """
+    for (name, value) in info.items():
+        if not isinstance(value, (basestring, int, float, type(None))):
+            info[name] = type(value).__name__
+    return Recording(info)
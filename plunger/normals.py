@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007 by Kai Blin
+#
+# Plunger is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""Generate vertex normals for meshes.
+
+Normals are accumulated into the vertices in one pass over the index buffer.
+With a smoothing angle, vertices shared by faces meeting at a sharper angle
+are split, so hard edges stay hard.
+"""
+
+import array
+import math
+from itertools import izip
+
+import dom
+
+# Ways to weight the face normals when accumulating them into the vertices
+WEIGHT_NONE = "none"
+WEIGHT_AREA = "area"
+WEIGHT_ANGLE = "angle"
+WEIGHTINGS = (WEIGHT_NONE, WEIGHT_AREA, WEIGHT_ANGLE)
+
+def faceNormals(positions, indices):
+    """Compute the unnormalised normal of every triangle.
+    Its length is twice the area of the triangle.
+    """
+    vectors = array.array('d', [0]) * len(indices)
+    p = positions
+    i = 0
+    for a, b, c in izip(indices[0::3], indices[1::3], indices[2::3]):
+        a *= 3
+        b *= 3
+        c *= 3
+        ux = p[b] - p[a]
+        uy = p[b+1] - p[a+1]
+        uz = p[b+2] - p[a+2]
+        vx = p[c] - p[a]
+        vy = p[c+1] - p[a+1]
+        vz = p[c+2] - p[a+2]
+        vectors[i] = uy * vz - uz * vy
+        vectors[i+1] = uz * vx - ux * vz
+        vectors[i+2] = ux * vy - uy * vx
+        i += 3
+    return vectors
+
+def cornerAngles(positions, indices):
+    """Compute the angle at every corner of every triangle
+    """
+    angles = array.array('d', [0]) * len(indices)
+    p = positions
+    for corner in xrange(len(indices)):
+        base = corner - corner % 3
+        a = indices[corner] * 3
+        b = indices[base + (corner + 1) % 3] * 3
+        c = indices[base + (corner + 2) % 3] * 3
+        ux = p[b] - p[a]
+        uy = p[b+1] - p[a+1]
+        uz = p[b+2] - p[a+2]
+        vx = p[c] - p[a]
+        vy = p[c+1] - p[a+1]
+        vz = p[c+2] - p[a+2]
+        length = math.sqrt((ux*ux + uy*uy + uz*uz) * (vx*vx + vy*vy + vz*vz))
+        if length:
+            cos = (ux*vx + uy*vy + uz*vz) / length
+            angles[corner] = math.acos(max(-1.0, min(1.0, cos)))
+    return angles
+
+def normalize(vectors, typecode=dom.FLOAT_TYPE):
+    """Return a copy of the flat list of 3d vectors, scaled to unit length.
+    Zero length vectors stay zero.
+    """
+    result = array.array(typecode, vectors)
+    for i in xrange(0, len(result), 3):
+        x = result[i]
+        y = result[i+1]
+        z = result[i+2]
+        length = math.sqrt(x*x + y*y + z*z)
+        if length:
+            result[i] = x / length
+            result[i+1] = y / length
+            result[i+2] = z / length
+    return result
+
+def accumulate(num_vertices, indices, vectors, per_corner=False,
+        corner_weights=None):
+    """Sum up the vectors of all corners referencing a vertex, and return the
+    normalised sums. "vectors" holds one vector per face, or one per corner
+    if per_corner is set.
+    """
+    sums = array.array('d', [0]) * (3 * num_vertices)
+    for corner, vertex in enumerate(indices):
+        if per_corner:
+            i = corner * 3
+        else:
+            i = corner - corner % 3
+        weight = 1.0
+        if corner_weights:
+            weight = corner_weights[corner]
+        vertex *= 3
+        sums[vertex] += vectors[i] * weight
+        sums[vertex+1] += vectors[i+1] * weight
+        sums[vertex+2] += vectors[i+2] * weight
+    return normalize(sums)
+
+def buildAdjacency(num_vertices, indices):
+    """Build an index of the corners around every vertex.
+    The corners of vertex v are corners[offsets[v]:offsets[v+1]].
+    """
+    offsets = array.array(dom.INDEX_TYPE, [0]) * (num_vertices + 1)
+    for vertex in indices:
+        offsets[vertex + 1] += 1
+    for vertex in xrange(num_vertices):
+        offsets[vertex + 1] += offsets[vertex]
+
+    corners = array.array(dom.INDEX_TYPE, [0]) * len(indices)
+    fill = offsets[:-1]
+    for corner, vertex in enumerate(indices):
+        corners[fill[vertex]] = corner
+        fill[vertex] += 1
+    return (offsets, corners)
+
+def splitVertices(mesh, unit_normals, vectors, corner_weights, smoothing_angle):
+    """Compute a normal for every corner from the faces around its vertex
+    that meet the corner's face at less than smoothing_angle degrees, and
+    split vertices that end up with more than one normal.
+    """
+    indices = mesh.indices
+    num_vertices = mesh.getNumVertices()
+    (offsets, corners) = buildAdjacency(num_vertices, indices)
+    cos_angle = math.cos(math.radians(smoothing_angle))
+
+    positions = mesh.positions
+    uv_coords = mesh.uv_coords
+    normals = array.array(dom.FLOAT_TYPE, [0]) * (3 * num_vertices)
+    new_indices = array.array(dom.INDEX_TYPE, indices)
+    assigned = {}
+    split_vertices = {}
+
+    for corner, vertex in enumerate(indices):
+        face = corner - corner % 3
+        fx = unit_normals[face]
+        fy = unit_normals[face+1]
+        fz = unit_normals[face+2]
+        x = y = z = 0.0
+        for other in corners[offsets[vertex]:offsets[vertex+1]]:
+            other_face = other - other % 3
+            if other_face != face and fx * unit_normals[other_face] + \
+                    fy * unit_normals[other_face+1] + \
+                    fz * unit_normals[other_face+2] < cos_angle:
+                continue
+            weight = 1.0
+            if corner_weights:
+                weight = corner_weights[other]
+            x += vectors[other_face] * weight
+            y += vectors[other_face+1] * weight
+            z += vectors[other_face+2] * weight
+        length = math.sqrt(x*x + y*y + z*z)
+        if length:
+            x /= length
+            y /= length
+            z /= length
+
+        key = (vertex, round(x, 5), round(y, 5), round(z, 5))
+        if key in split_vertices:
+            new_indices[corner] = split_vertices[key]
+            continue
+
+        if vertex in assigned:
+            new_vertex = len(positions) // 3
+            positions.extend(positions[vertex*3:vertex*3+3])
+            if uv_coords:
+                uv_coords.extend(uv_coords[vertex*2:vertex*2+2])
+            normals.extend((x, y, z))
+        else:
+            assigned[vertex] = True
+            new_vertex = vertex
+            normals[vertex*3:vertex*3+3] = array.array(dom.FLOAT_TYPE,
+                    (x, y, z))
+        split_vertices[key] = new_vertex
+        new_indices[corner] = new_vertex
+
+    mesh.indices = new_indices
+    mesh.normals = normals
+
+def generateNormals(mesh, weighting=WEIGHT_AREA, smoothing_angle=None):
+    """Generate the face and vertex normals of a mesh from its geometry.
+    Face normals are weighted by area, corner angle or not at all.
+    If smoothing_angle is given in degrees, vertices on sharper edges are
+    split. Raises ValueError for an unknown weighting.
+    """
+    if weighting not in WEIGHTINGS:
+        raise ValueError("unknown normal weighting '%s'" % weighting)
+
+    vectors = faceNormals(mesh.positions, mesh.indices)
+    unit_normals = normalize(vectors, 'd')
+    mesh.face_normals = normalize(unit_normals)
+
+    corner_weights = None
+    if weighting == WEIGHT_ANGLE:
+        corner_weights = cornerAngles(mesh.positions, mesh.indices)
+    if weighting != WEIGHT_AREA:
+        vectors = unit_normals
+
+    if smoothing_angle is None:
+        mesh.normals = accumulate(mesh.getNumVertices(), mesh.indices,
+                vectors, corner_weights=corner_weights)
+    else:
+        splitVertices(mesh, unit_normals, vectors, corner_weights,
+                smoothing_angle)
+
+def averageNormals(mesh, corner_normals):
+    """Set the vertex normals of a mesh to the average of the normals given
+    for all corners using the vertex, e.g. by a Collada NORMAL input.
+    """
+    mesh.face_normals = normalize(faceNormals(mesh.positions, mesh.indices))
+    mesh.normals = accumulate(mesh.getNumVertices(), mesh.indices,
+            corner_normals, per_corner=True)
+
+def needsNormals(mesh):
+    """Check if a mesh lacks normals for some of its vertices
+    """
+    return len(mesh.normals) != len(mesh.positions)
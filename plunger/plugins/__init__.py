@@ -1 +1,13 @@
 __all__ = ["collada", "info", "md3", "ogrexml", "sear"]
+
+# What every plugin handles, so formats can be registered and detected without
+# importing the plugins. Keep in sync with the format, does_import/does_export
+# attributes and the sniff() function of the modules.
+# (module, format, does_import, does_export, magic bytes, XML root element)
+manifest = [
+    ("collada", "collada", True, True, None, "COLLADA"),
+    ("info", "info", False, True, None, None),
+    ("md3", "md3", True, True, "IDP3", None),
+    ("ogrexml", "ogrexml", True, True, None, "mesh"),
+    ("sear", "sear", True, True, "SEARSTAT", None),
+]
@@ -21,11 +21,13 @@ The module supports import and export.
 """
 
 try:
-    from plunger import toolbox
+    from plunger import toolbox, dom, instrument
 except ImportError:
     import sys
     sys.path.append("..")
     import toolbox
+    import dom
+    import instrument
     sys.path.pop()
 
 from collada_plugin.parser import Parser
@@ -36,22 +38,32 @@ ext = ".dae"
 needs_dir = False
 does_import = True
 does_export = True
+version = "0.1.0"
+
+def sniff(header):
+    """Check if data starting with "header" is a collada document
+    """
+    return toolbox.getRootElement(header) == "COLLADA"
 
 def importAsset(model, asset):
     """Import a collada .dae file.
     """
-    from xml.dom import minidom
     sock = toolbox.openAny(asset)
-    xmldom = minidom.parse(sock)
-    sock.close()
     p = Parser(model)
-    p.parse(xmldom)
-
-def exportAsset(model, asset):
+    with instrument.span("parse"):
+        p.parse(sock)
+    sock.close()
 
-    g = Generator()
-    g.generate(model)
+def importMeshes(asset):
+    """Yield the meshes of a collada .dae file as they are parsed
+    """
+    sock = toolbox.openAny(asset)
+    p = Parser(dom.Model())
+    for mesh in p.parseMeshes(sock):
+        yield mesh
+    sock.close()
 
+def exportAsset(model, asset):
     import sys
     file = None
     try:
@@ -60,9 +72,13 @@ def exportAsset(model, asset):
         print "Failed to open '%s' for writing" % asset
         sys.exit(1)
 
+    g = Generator(out=file)
     try:
-        file.write(g.toxml())
-        file.close()
+        with instrument.span("generate"):
+            g.generate(model)
+        with instrument.span("write"):
+            g.flush()
+            file.close()
     except IOError:
         print "Writing '%s' failed." % asset
         sys.exit(1)
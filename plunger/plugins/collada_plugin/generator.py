@@ -18,9 +18,25 @@
 """Generate Collada XML output from a Plunger DOM
 """
 
+import StringIO
+
+try:
+    from plunger import toolbox
+except ImportError:
+    import sys
+    sys.path.append("../..")
+    import toolbox
+    sys.path.pop()
+
 class Generator:
-    def __init__(self, indent_depth=4):
-        self.out_string = ""
+    """Write the generated XML to the stream "out" as it is generated.
+    Without a stream, the XML is kept in memory and returned by toxml().
+    """
+    def __init__(self, indent_depth=4, out=None):
+        if out is None:
+            out = StringIO.StringIO()
+        self.out = out
+        self.writer = toolbox.BufferedWriter(out)
         self.indent_depth = indent_depth
 
     def indent(self, depth):
@@ -28,7 +44,12 @@ class Generator:
         self.append(indent_string)
 
     def append(self, string):
-        self.out_string += string
+        self.writer.write(string)
+
+    def flush(self):
+        """Write out everything that is still buffered
+        """
+        self.writer.flush()
 
     def appendIfAttr(self, node, attr):
         obj_attr = getattr(node, attr, None)
@@ -36,7 +57,8 @@ class Generator:
             self.append(' %s="%s"' % (attr, obj_attr))
 
     def toxml(self):
-        return self.out_string
+        self.flush()
+        return self.out.getvalue()
 
     def generate(self, node, depth=0):
         """Dispatch a function to generate XML for a specific node
@@ -257,9 +279,9 @@ class Generator:
             if(i % stride == 0):
                 self.append('\n')
                 self.indent(depth+1)
-                self.append('%s' % node.values[i])
+                self.append(toolbox.formatFloat(node.values[i]))
             else:
-                self.append(' %s' % node.values[i])
+                self.append(' %s' % toolbox.formatFloat(node.values[i]))
 
         self.append('\n')
         self.indent(depth)
@@ -17,22 +17,37 @@
 # 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
 """Parser for the Collada XML format.
 Right now there is incomplete support for the Collada 1.4.2 specification.
+
+The parser is driven by expat events, so the geometry is stored in the DOM
+while the file is being read and no XML tree is ever built.
 """
 
+import array
+from xml.parsers import expat
+
 try:
     from plunger import dom
+    from plunger import instrument
+    from plunger import normals
+    from plunger import toolbox
 except ImportError:
     import sys
     sys.path.append("../..")
     import dom
+    import instrument
+    import normals
+    import toolbox
     sys.path.pop()
 
-def addAttr(obj, node, attr, convert_fun=lambda x: x):
-    """Add attribute "attr" to object "obj" if the node "node" has said
-    attribute. If convert is set, convert the nodeValue to type.
+# Elements whose text content is needed by their end_* handler
+TEXT_ELEMENTS = ("float_array", "p")
+
+def addAttr(obj, attrs, attr, convert_fun=lambda x: x):
+    """Add attribute "attr" to object "obj" if the attribute dict "attrs" has
+    said attribute. If convert is set, convert the value to type.
     """
-    if attr in node.attributes.keys():
-        setattr(obj, attr, convert_fun(node.attributes[attr].nodeValue))
+    if attr in attrs:
+        setattr(obj, attr, convert_fun(attrs[attr]))
 
 class Source:
     """Model <source> tags that hold data until it can be stored in the DOM
@@ -42,13 +57,48 @@ class Source:
         self.values = []
         self.accessor = {}
 
+class Inputs:
+    """Collect the <input> and <p> children of a tag until it is closed
+    """
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.id = ""
+        self.count = 0
+        self.inputs = []
+        self.primitives = array.array(dom.INDEX_TYPE)
+
+    def getStride(self):
+        """Get the number of indices per vertex in the <p> tag
+        """
+        max_offset = 0
+        for input in self.inputs:
+            if "offset" in input:
+                max_offset = max(max_offset, int(input['offset']))
+        return max_offset + 1
+
 class Parser:
     """Parse Collada XML files
+
+    For every element, start_<tag>(attrs, parent) is called when it is opened.
+    It returns the object its children are parsed into, or None to skip the
+    whole subtree. If present, end_<tag>(obj, text) is called when the
+    element is closed.
     """
 
     def __init__(self, model):
         self.model = model
         self.known_sources = {}
+        self.mesh_sources = []
+        self.stack = []
+        self.skip_depth = 0
+        self.text = None
+        self.start_handlers = {}
+        self.end_handlers = {}
+        # with keep_meshes unset, finished meshes are moved from the model to
+        # finished_meshes, see parseMeshes()
+        self.keep_meshes = True
+        self.mesh_ids = []
+        self.finished_meshes = []
 
     def registerId(self, id, object):
         self.known_sources[id] = object
@@ -61,346 +111,438 @@ class Parser:
             return self.known_sources[id]
         return None
 
-    def parse(self, node, parent=None):
-        """Dispatch the correct function to parse the node
-        """
-        parse_function = getattr(self, "parse%s" % node.__class__.__name__)
-        parse_function(node, parent)
+    def createParser(self):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characterData
+        return parser
+
+    def parse(self, stream, chunk_size=65536):
+        """Parse the Collada document read from "stream", chunk by chunk
+        """
+        parser = self.createParser()
+
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            parser.Parse(data, False)
+        parser.Parse("", True)
+
+    def parseMeshes(self, stream, chunk_size=65536):
+        """Parse the Collada document read from "stream", yielding every mesh
+        once its <mesh> tag is closed. The meshes are not kept in the model.
+        """
+        self.keep_meshes = False
+        parser = self.createParser()
+
+        while True:
+            data = stream.read(chunk_size)
+            with instrument.span("parse") as span:
+                parser.Parse(data, not data)
+                span.count(bytes=len(data))
+            for mesh in self.finished_meshes:
+                yield mesh
+            self.finished_meshes = []
+            if not data:
+                break
+
+    def getStartHandler(self, name):
+        if name not in self.start_handlers:
+            self.start_handlers[name] = getattr(self, "start_%s" % name,
+                    self.start_nyi)
+        return self.start_handlers[name]
+
+    def getEndHandler(self, name):
+        if name not in self.end_handlers:
+            self.end_handlers[name] = getattr(self, "end_%s" % name, None)
+        return self.end_handlers[name]
+
+    def startElement(self, name, attrs):
+        """Dispatch the correct function to handle the opened tag
+        """
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
 
-    def parseChildNodes(self, node, parent):
-        for child in node.childNodes:
-            self.parse(child, parent)
+        parent = None
+        if self.stack:
+            parent = self.stack[-1][1]
 
-    def parseComment(self, node, parent):
-        """Ignore comments
-        """
-        pass
+        obj = self.getStartHandler(name)(attrs, parent)
+        if obj is None:
+            self.skip_depth = 1
+            return
 
-    def parseDocument(self, node, parent):
-        """Just parse the documentElement
-        """
-        self.parse(node.documentElement)
+        self.stack.append((name, obj))
+        if name in TEXT_ELEMENTS:
+            self.text = []
 
-    def parseElement(self, node, parent):
-        """Parse a tag
+    def endElement(self, name):
+        """Dispatch the correct function to handle the closed tag
         """
-        handler_function = getattr(self, "do_%s" % node.tagName, self.do_nyi)
-        handler_function(node, parent)
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
 
-    def parseText(self, node, parent):
-        """Parse text
-        Silently ignore text.
+        obj = self.stack.pop()[1]
+        text = None
+        if self.text is not None:
+            text = "".join(self.text)
+            self.text = None
+
+        handler = self.getEndHandler(name)
+        if handler:
+            handler(obj, text)
+
+    def characterData(self, data):
+        """Collect text, if the current tag needs it
         """
-        pass
+        if self.text is not None:
+            self.text.append(data)
 
-    def do_nyi(self, node, parent):
+    def start_nyi(self, attrs, parent):
         """Handle all elements that do not have a function yet
         """
-        print "WARNING: unimplemented tag %s!" % node.tagName
+        name = self.stack and self.stack[-1][0] or ""
+        print "WARNING: unimplemented tag inside <%s>!" % name
+        return None
 
-    def do_COLLADA(self, node, parent):
+    def start_COLLADA(self, attrs, parent):
         """Handle the COLLADA tag
-        We're interested in the version and xmlns attributes for now
         """
-        self.model.collada_xml = node.toxml()
-        self.parseChildNodes(node, self.model)
+        return self.model
 
-    def do_accessor(self, node, parent):
+    def start_accessor(self, attrs, parent):
         """Handle the <accessor> tag
         """
-        keys = node.attributes.keys()
+        if "count" in attrs:
+            parent.accessor["count"] = int(attrs["count"])
 
-        if "count" in keys:
-            parent.accessor["count"] = int(node.attributes["count"].nodeValue)
+        if "offset" in attrs:
+            parent.accessor["offset"] = int(attrs["offset"])
 
-        if "offset" in keys:
-            parent.accessor["offset"] = int(node.attributes["offset"].nodeValue)
+        if "source" in attrs:
+            parent.accessor["source"] = attrs["source"]
 
-        if "source" in keys:
-            parent.accessor["source"] = node.attributes["source"].nodeValue
+        if "stride" in attrs:
+            parent.accessor["stride"] = int(attrs["stride"])
 
-        if "stride" in keys:
-            parent.accessor["stride"] = int(node.attributes["stride"].nodeValue)
+        return None
 
-    def do_asset(self, node, parent):
+    def start_asset(self, attrs, parent):
         """Skip the <asset> tag
         """
-        pass
+        return None
 
-    def do_author(self, node, parent):
+    def start_author(self, attrs, parent):
         """Handle the <author> tag
         """
         raise NotImplementedError
 
-    def do_authoring_tool(self, node, parent):
+    def start_authoring_tool(self, attrs, parent):
         """Handle the <authoring_tool> tag
         """
         raise NotImplementedError
 
-    def do_bool_array(self, node, parent):
+    def start_bool_array(self, attrs, parent):
         """Handle the <bool_array> tag
         """
         raise NotImplementedError
 
-    def do_comments(self, node, parent):
+    def start_comments(self, attrs, parent):
         """Handle the <comments> tag
         """
         raise NotImplementedError
 
-    def do_contributor(self, node, parent):
+    def start_contributor(self, attrs, parent):
         """Handle the <contributor> tag
         """
         raise NotImplementedError
 
-    def do_copyright(self, node, parent):
+    def start_copyright(self, attrs, parent):
         """Handle the <copyright> tag
         """
         raise NotImplementedError
 
-    def do_created(self, node, parent):
+    def start_created(self, attrs, parent):
         """Handle the <created> tag
         """
         raise NotImplementedError
 
-    def do_convex_mesh(self, node, parent):
-        """Handle the <convex_mesh> tag
+    def start_convex_mesh(self, attrs, parent):
+        """Skip the <convex_mesh> tag
         """
-        raise NotImplementedError
+        return None
 
-    def do_extra(self, node, parent):
+    def start_extra(self, attrs, parent):
         """skip the <extra> tag
         """
-        pass
+        return None
 
-    def do_float_array(self, node, parent):
+    def start_float_array(self, attrs, parent):
         """Handle the <float_array> tag
         """
-        count = 0
-        if "count" in node.attributes.keys():
-            count = int(node.attributes["count"].nodeValue)
+        parent.count = 0
+        if "count" in attrs:
+            parent.count = int(attrs["count"])
+        return parent
 
-        if node.firstChild:
-            parent.values = [float(f) for f in
-                node.firstChild.nodeValue.split()[:count]]
+    def end_float_array(self, source, text):
+        """Store the contents of the <float_array> tag
+        """
+        if text:
+            source.values = toolbox.parseArray(dom.FLOAT_TYPE, text,
+                    source.count)
 
-    def do_geometry(self, node, parent):
+    def start_geometry(self, attrs, parent):
         """Handle the <geometry> tag
         """
-        mesh = dom.Mesh()
-
-        for child in node.childNodes:
-            if not child.__class__.__name__ == "Element":
-                continue
-
-            if child.tagName == "mesh":
-                parent.meshes.append(mesh)
-                mesh.parent = parent
-                self.parse(child, mesh)
+        return parent
 
-    def do_h(self, node, parent):
+    def start_h(self, attrs, parent):
         """Handle the <h> primitives tag
         """
         raise NotImplementedError
 
-    def do_IDREF_array(self, node, parent):
+    def start_IDREF_array(self, attrs, parent):
         """Handle the <IDEREF_array> tag
         """
         raise NotImplementedError
 
-    def do_int_array(self, node, parent):
+    def start_input(self, attrs, parent):
+        """Handle the <input> tag
+        """
+        parent.inputs.append(attrs)
+        return None
+
+    def start_int_array(self, attrs, parent):
         """Handle the <int_array> tag
         """
         raise NotImplementedError
 
-    def do_keywords(self, node, parent):
+    def start_keywords(self, attrs, parent):
         """Handle the <keywords> tag
         """
         raise NotImplementedError
 
-    def do_library_animations(self, node, parent):
+    def start_library_animations(self, attrs, parent):
         """skip the <library_animations> tag
         """
-        pass
+        return None
 
-    def do_library_animation_clips(self, node, parent):
+    def start_library_animation_clips(self, attrs, parent):
         """skip the <library_animation_clips> tag
         """
-        pass
+        return None
 
-    def do_library_cameras(self, node, parent):
+    def start_library_cameras(self, attrs, parent):
         """skip the <library_cameras> tag
         """
-        pass
+        return None
 
-    def do_library_controllers(self, node, parent):
+    def start_library_controllers(self, attrs, parent):
         """skip the <library_controllers> tag
         """
-        pass
+        return None
 
-    def do_library_effects(self, node, parent):
+    def start_library_effects(self, attrs, parent):
         """skip the <library_effects> tag
         """
-        pass
+        return None
 
-    def do_library_force_fields(self, node, parent):
+    def start_library_force_fields(self, attrs, parent):
         """skip the <library_force_fields> tag
         """
-        pass
+        return None
 
-    def do_library_geometries(self, node, parent):
+    def start_library_geometries(self, attrs, parent):
         """handle the <library_geometries> tag
         """
         meshes = dom.Meshes()
         meshes.parent = parent
         parent.meshes = meshes
-        self.parseChildNodes(node, meshes)
+        return meshes
 
-    def do_library_images(self, node, parent):
+    def start_library_images(self, attrs, parent):
         """skip the <library_images> tag
         """
-        pass
+        return None
 
-    def do_library_lights(self, node, parent):
+    def start_library_lights(self, attrs, parent):
         """skip the <library_lights> tag
         """
-        pass
+        return None
 
-    def do_library_materials(self, node, parent):
+    def start_library_materials(self, attrs, parent):
         """skip the <library_materials> tag
         """
-        pass
+        return None
 
-    def do_library_nodes(self, node, parent):
+    def start_library_nodes(self, attrs, parent):
         """skip the <library_nodes> tag
         """
-        pass
+        return None
 
-    def do_library_physics_materials(self, node, parent):
+    def start_library_physics_materials(self, attrs, parent):
         """skip the <library_physics_materials> tag
         """
-        pass
+        return None
 
-    def do_library_physics_models(self, node, parent):
+    def start_library_physics_models(self, attrs, parent):
         """skip the <library_physics_models> tag
         """
-        pass
+        return None
 
-    def do_library_physics_scenes(self, node, parent):
+    def start_library_physics_scenes(self, attrs, parent):
         """skip the <library_physics_scenes> tag
         """
-        pass
+        return None
 
-    def do_library_visual_scenes(self, node, parent):
+    def start_library_visual_scenes(self, attrs, parent):
         """skip the <library_effects> tag
         """
-        pass
+        return None
 
-    def do_lines(self, node, parent):
+    def start_lines(self, attrs, parent):
         """Handle the <lines> tag
         """
         raise NotImplementedError
 
-    def do_linestrips(self, node, parent):
+    def start_linestrips(self, attrs, parent):
         """Handle the <linestrips> tag
         """
         raise NotImplementedError
 
-    def do_mesh(self, node, parent):
+    def start_mesh(self, attrs, parent):
         """Handle the <mesh> tag
         """
-        self.parseChildNodes(node, parent)
-
-    def do_modified(self, node, parent):
+        mesh = dom.Mesh()
+        mesh.parent = parent
+        parent.meshes.append(mesh)
+        return mesh
+
+    def end_mesh(self, mesh, text):
+        """Forget the sources of the finished <mesh> tag
+        """
+        for id in self.mesh_sources:
+            if id in self.known_sources:
+                del self.known_sources[id]
+        self.mesh_sources = []
+
+        if not self.keep_meshes:
+            for id in self.mesh_ids:
+                self.model.idmap.pop(id, None)
+            self.mesh_ids = []
+            mesh.parent.meshes.remove(mesh)
+            mesh.parent = None
+            self.finished_meshes.append(mesh)
+
+    def start_modified(self, attrs, parent):
         """Handle the <modified> tag
         """
         raise NotImplementedError
 
-    def do_Name_array(self, node, parent):
+    def start_Name_array(self, attrs, parent):
         """Handle the <Name_array> tag
         """
         raise NotImplementedError
 
-    def do_param(self, node, parent):
+    def start_p(self, attrs, parent):
+        """Handle the <p> primitives tag
+        """
+        return parent
+
+    def end_p(self, parent, text):
+        """Store the contents of the <p> tag
+        """
+        count = None
+        if parent.count:
+            count = parent.count * 3 * parent.getStride()
+        if text:
+            parent.primitives = toolbox.parseArray(dom.INDEX_TYPE, text, count)
+
+    def start_param(self, attrs, parent):
         """Handle the <param> tag
         """
         raise NotImplementedError
 
-    def do_ph(self, node, parent):
+    def start_ph(self, attrs, parent):
         """Handle the <ph> tag
         """
-        polyhole = dom.PolyHoles()
-        polyhole.parent = parent
-        parent.polyholes.append(polyhole)
-
-        self.parseChildNodes(node, polyhole)
+        raise NotImplementedError
 
-    def do_polygons(self, node, parent):
+    def start_polygons(self, attrs, parent):
         """Handle the <polygons> tag
         """
         raise NotImplementedError
 
-    def do_polylist(self, node, parent):
+    def start_polylist(self, attrs, parent):
         """Handle the <polylist> tag
         """
         raise NotImplementedError
 
-    def do_revision(self, node, parent):
+    def start_revision(self, attrs, parent):
         """Handle the <revision> tag
         """
         raise NotImplementedError
 
-    def do_scene(self, node, parent):
+    def start_scene(self, attrs, parent):
         """skip the <scene> tag
         """
-        pass
+        return None
 
-    def do_source(self, node, parent):
+    def start_source(self, attrs, parent):
         """Handle the <source> tag
         """
         source = Source()
         source.parent = parent
 
-        addAttr(source, node, "name")
-        addAttr(source, node, "id")
+        addAttr(source, attrs, "name")
+        addAttr(source, attrs, "id")
         self.registerId(source.id, source)
+        self.mesh_sources.append(source.id)
 
-        self.parseChildNodes(node, source)
+        return source
 
-    def do_source_data(self, node, parent):
+    def start_source_data(self, attrs, parent):
         """Handle the <source_data> tag
         """
         raise NotImplementedError
 
-    def do_subject(self, node, parent):
+    def start_subject(self, attrs, parent):
         """Handle the <subject> tag
         """
-        raise NotImplemtentedError
+        raise NotImplementedError
 
-    def do_technique(self, node, parent):
+    def start_technique(self, attrs, parent):
         """Handle the <technique> tag
         """
         raise NotImplementedError
 
-    def do_technique_common(self, node, parent):
+    def start_technique_common(self, attrs, parent):
         """Handle the <technique_common> tag
         """
-        self.parseChildNodes(node, parent)
+        return parent
 
-    def do_title(self, node, parent):
+    def start_title(self, attrs, parent):
         """Handle the <title> tag
         """
         raise NotImplementedError
 
-    def do_triangles(self, node, parent):
+    def start_triangles(self, attrs, parent):
         """Handle the <triangles> tag
         """
-        faces = dom.Faces()
-        faces.parent = parent
-        parent.faces = faces
-
-        if "count" in node.attributes.keys():
-            faces.count = int(node.attributes['count'].nodeValue)
+        triangles = Inputs(parent)
+        if "count" in attrs:
+            triangles.count = int(attrs['count'])
+        return triangles
 
+    def end_triangles(self, triangles, text):
+        """Store the faces of the <triangles> tag in the mesh
+        """
         vertex_offset = 0
         vertex_source = ""
         normal_offset = 0
@@ -408,154 +550,100 @@ class Parser:
         tex_coord_offset = 0
         tex_coord_source = ""
         semantic = ""
-        primitives = []
-        max_offset = 0
-
-        for child in node.childNodes:
-            if not child.__class__.__name__ == "Element":
-                continue
-
-            if child.tagName == "input":
-                keys = child.attributes.keys()
-                if "semantic" in keys:
-                    semantic = child.attributes['semantic'].nodeValue
-
-                if semantic == "VERTEX":
-                    if "offset" in keys:
-                        vertex_offset = int(child.attributes['offset'].nodeValue)
-                        if vertex_offset > max_offset:
-                            max_offset = vertex_offset
-                    if "source" in keys:
-                        vertex_source =\
-                            child.attributes['source'].nodeValue.replace('#','')
-                elif semantic == "NORMAL":
-                    if "offset" in keys:
-                        normal_offset = int(child.attributes['offset'].nodeValue)
-                        if normal_offset > max_offset:
-                            max_offset = normal_offset
-                    if "source" in keys:
-                        normal_source =\
-                            child.attributes['source'].nodeValue.replace('#','')
-                elif semantic == "TEXCOORD":
-                    if "offset" in keys:
-                        tex_coord_offset = int(child.attributes['offset'].nodeValue)
-                        if tex_coord_offset > max_offset:
-                            max_offset = tex_coord_offset
-                else:
-                    if "offset" in keys:
-                        offset = int(child.attributes['offset'].nodeValue)
-                        if offset > max_offset:
-                            max_offset = offset
-
-            elif child.tagName == "p":
-                if child.firstChild:
-                    primitives = [int(i) for i in
-                    child.firstChild.nodeValue.split()]
-
-        normals = self.lookupId(normal_source)
-
-        for i in range(0,len(primitives), (max_offset + 1) * 3 ):
-            face = dom.Face()
-            face.parent = faces
-            faces.faces.append(face)
-            if vertex_source:
-                vlist = []
-                vlist.append(primitives[ i + vertex_offset])
-                vlist.append(primitives[ i + vertex_offset + max_offset +1])
-                vlist.append(primitives[ i + vertex_offset + (2* (max_offset + 1))])
-                face.vertex_list = vlist
-
-            if normals:
-                nlist = []
-                nlist.append(primitives[ i + normal_offset])
-                nlist.append(primitives[ i + normal_offset + max_offset + 1])
-                nlist.append(primitives[ i + normal_offset + (2* (max_offset + 1))])
-                for item in nlist:
-                    face.normals.append(normals.values[item])
-
-        mesh = faces.parent
-        vidx = 0
-        for vertex in mesh.getVertices():
-            x = 0
-            y = 0
-            z = 0
-            total = 0
-            for face in faces.faces:
-                if vidx in face.vertex_list:
-                    x += face.normals[0]
-                    y += face.normals[1]
-                    z += face.normals[2]
-                    total += 1
-            if total:
-                x /= total
-                y /= total
-                z /= total
-
-            import math
-            length = math.sqrt(x*x + y*y + z*z)
-            if length:
-                x /= length
-                y /= length
-                z /= length
-
-            vertex.normals = [x, y, z]
-            vidx += 1
-
-    def do_trifans(self, node, parent):
+        primitives = triangles.primitives
+
+        for input in triangles.inputs:
+            if "semantic" in input:
+                semantic = input['semantic']
+
+            offset = 0
+            if "offset" in input:
+                offset = int(input['offset'])
+
+            if semantic == "VERTEX":
+                vertex_offset = offset
+                if "source" in input:
+                    vertex_source = input['source'].replace('#','')
+            elif semantic == "NORMAL":
+                normal_offset = offset
+                if "source" in input:
+                    normal_source = input['source'].replace('#','')
+            elif semantic == "TEXCOORD":
+                tex_coord_offset = offset
+
+        mesh = triangles.mesh
+        stride = triangles.getStride()
+        if vertex_source:
+            mesh.indices = primitives[vertex_offset::stride]
+
+        normal_values = None
+        if normal_source:
+            normal_values = self.lookupId(normal_source)
+
+        if normal_values:
+            normal_stride = normal_values.accessor.get("stride", 3)
+            values = normal_values.values
+            corner_normals = array.array(dom.FLOAT_TYPE)
+            for item in primitives[normal_offset::stride]:
+                item *= normal_stride
+                corner_normals.extend(values[item:item+3])
+            normals.averageNormals(mesh, corner_normals)
+        else:
+            normals.generateNormals(mesh)
+
+    def start_trifans(self, attrs, parent):
         """Handle the <trifans> tag
         """
         raise NotImplementedError
 
-    def do_tristrips(self, node, parent):
+    def start_tristrips(self, attrs, parent):
         """Handle the <tristrips> tag
         """
         raise NotImplementedError
 
-    def do_unit(self, node, parent):
+    def start_unit(self, attrs, parent):
         """Handle the <unit> tag
         """
         raise NotImplementedError
 
-    def do_up_axis(self, node, parent):
+    def start_up_axis(self, attrs, parent):
         """Handle the <up_axis> tag
         """
         raise NotImplementedError
 
-    def do_vcount(self, node, parent):
+    def start_vcount(self, attrs, parent):
         """Handle the <vcount> tag
         """
         raise NotImplementedError
 
-    def do_vertices(self, node, parent):
+    def start_vertices(self, attrs, parent):
         """Handle the <vertices> tag
         """
-        vertices = dom.Vertices()
-        parent.vertices = vertices
-        vertices.parent = parent
+        vertices = Inputs(parent)
+
+        if "id" in attrs:
+            vertices.id = attrs['id']
+            self.model.registerId(vertices.id, parent.vertices)
+            self.mesh_ids.append(vertices.id)
 
-        if "id" in node.attributes.keys():
-            self.model.registerId(node.attributes['id'].nodeValue, vertices)
+        return vertices
 
-        offset = 0
+    def end_vertices(self, vertices, text):
+        """Store the positions referenced by the <vertices> tag in the mesh
+        """
         source = ""
         semantic = ""
 
-        for child in node.childNodes:
-            if not child.__class__.__name__ == "Element":
-                continue
-
-            if child.tagName == "input":
-                keys = child.attributes.keys()
-                if "semantic" in keys:
-                    semantic = child.attributes['semantic'].nodeValue
+        for input in vertices.inputs:
+            if "semantic" in input:
+                semantic = input['semantic']
 
-                if not semantic == "POSITION":
-                    print "Looks like an invalid tag, ignoring"
-                    return
-                else:
-                    if "source" in keys:
-                        source =\
-                            child.attributes['source'].nodeValue.replace('#', '')
+            if not semantic == "POSITION":
+                print "Looks like an invalid tag, ignoring"
+                return
+            else:
+                if "source" in input:
+                    source = input['source'].replace('#', '')
 
         positions = self.lookupId(source)
 
@@ -563,12 +651,7 @@ class Parser:
             print "Error: could not load source '%s'" % source
             return
 
-        i = 0
-        for i in range(0, len(positions.values), 3):
-            vertex = dom.Vertex()
-            vertex.parent = vertices
-            vertices.vertices.append(vertex)
-
-            vertex.position = positions.values[i:i+3]
-            vertex.uv_coords = [0,0]
-
+        mesh = vertices.mesh
+        mesh.positions = dom.toFloatArray(positions.values)
+        mesh.uv_coords = array.array(dom.FLOAT_TYPE, [0]) * \
+                (2 * mesh.getNumVertices())
@@ -62,10 +62,14 @@ def exportMeshInfo(model, out):
     for mesh in model.getMeshes():
         out.write("Handling mesh %s.\n" % i)
         out.write("Number of vertices: %s\n" % mesh.getNumVertices())
+        fmt = toolbox.formatFloat
         for vertex in mesh.getVertices():
-            out.write("pos:  point(%s, %s, %s)\n" % tuple(vertex.getPosition()))
-            out.write("normal: vec(%s, %s, %s)\n" % tuple(vertex.getNormals()))
-            out.write("uv:     vec(%s, %s)\n" % tuple(vertex.getUVCoords()))
+            out.write("pos:  point(%s, %s, %s)\n" %
+                    tuple(map(fmt, vertex.getPosition())))
+            out.write("normal: vec(%s, %s, %s)\n" %
+                    tuple(map(fmt, vertex.getNormals())))
+            out.write("uv:     vec(%s, %s)\n" %
+                    tuple(map(fmt, vertex.getUVCoords())))
             out.write("---\n")
         out.write("Number of faces: %s\n" % mesh.getNumFaces())
         for face in mesh.getFaces():
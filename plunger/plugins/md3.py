@@ -17,25 +17,33 @@
 # 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
 """The plunger file handler for the MD3 format.
 
-The module supports export only for now.
+The module supports export and import.
 """
 
+import array
 import math
 import struct
+import sys
 
 try:
     from plunger import toolbox
+    from plunger import dom
+    from plunger import instrument
+    from plunger import normals
 except ImportError:
-    import sys
     sys.path.append('..')
     import toolbox
+    import dom
+    import instrument
+    import normals
     sys.path.pop()
 
 format = "md3"
-extension = ".md3"
+ext = ".md3"
 needs_dir = False
 does_export = True
-does_import = False
+does_import = True
+version = "1"
 
 # Info from http://icculus.org/homepages/phaethon/q3a/formats/md3format.html
 # Augmented by the libmodelfile headers by Alistair Riddoch, as the specfile
@@ -49,6 +57,41 @@ MD3_MAX_SHADERS = 256
 MD3_MAX_VERTS = 4096
 MD3_MAX_TRIANGLES = 8192
 
+# Vertex positions are stored as fixed point shorts in units of 1/64
+MD3_XYZ_SCALE = 1.0 / 64
+MD3_MAX_COORD = 32767 * MD3_XYZ_SCALE
+MD3_MIN_COORD = -32768 * MD3_XYZ_SCALE
+
+# All MD3 data is little endian
+HEADER_FMT = "<4s i 64s i iiii iiii"
+FRAME_FMT = "<3f 3f 3f f 16s"
+TAG_FMT = "<64s 3f 3f 3f 3f"
+SURFACE_FMT = "<4s 64s i iiii iiiii"
+SHADER_FMT = "<64s i"
+TRIANGLE_FMT = "<3i"
+TEXCOORD_FMT = "<2f"
+VERTEX_FMT = "<3h BB"
+
+def unpackArray(typecode, data, offset, count):
+    """Decode "count" little endian values of "typecode" at offset in one go
+    """
+    values = array.array(typecode)
+    block = buffer(data, offset, count * values.itemsize)
+    if count < 0 or len(block) != count * values.itemsize:
+        raise ValueError("truncated MD3 file")
+    values.fromstring(block)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def packArray(values):
+    """Get the little endian representation of an array
+    """
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
 class Md3Frame:
     def __init__(self):
         self.min_bounds = [0,0,0]
@@ -56,142 +99,188 @@ class Md3Frame:
         self.local_origin = [0,0,0]
         self.radius = 0.0
         self.name = ""
-        self.fmt = "fff fff fff f 8s"
+        self.fmt = FRAME_FMT
 
     def packSize(self):
         return struct.calcsize(self.fmt)
 
     def pack(self):
-        pack_str = ""
-        pack_str += struct.pack("fff", self.min_bounds.split())
-        pack_str += struct.pack("fff", self.max_bounds.split())
-        pack_str += struct.pack("fff", self.local_origin.split())
-        pack_str += struct.pack("f", self.radius)
-        pack_str += struct.pack("8s", self.name)
-        return pack_str
+        values = list(self.min_bounds) + list(self.max_bounds) + \
+                list(self.local_origin)
+        values.append(self.radius)
+        values.append(self.name)
+        return struct.pack(self.fmt, *values)
+
+    def unpack(self, data, offset=0):
+        values = struct.unpack_from(self.fmt, data, offset)
+        self.min_bounds = list(values[0:3])
+        self.max_bounds = list(values[3:6])
+        self.local_origin = list(values[6:9])
+        self.radius = values[9]
+        self.name = values[10].split('\0', 1)[0]
+        return offset + self.packSize()
 
 class Md3Tag:
     def __init__(self):
         self.name = ""
         self.origin = [0,0,0]
         self.axis = [[1,0,0], [0,1,0], [0,0,1]]
-        self.fmt = "64s fff fff fff fff"
+        self.fmt = TAG_FMT
 
     def packSize(self):
         return struct.calcsize(self.fmt)
 
     def pack(self):
-        pack_str = ""
-        pack_str += struct.pack("64s", self.name)
-        pack_str += struct.pack("fff", self.origin.split())
+        values = [self.name]
+        values.extend(self.origin)
         for row in self.axis:
-            pack_str += struct.pack("fff", row.split())
-        return pack_str
+            values.extend(row)
+        return struct.pack(self.fmt, *values)
+
+    def unpack(self, data, offset=0):
+        values = struct.unpack_from(self.fmt, data, offset)
+        self.name = values[0].split('\0', 1)[0]
+        self.origin = list(values[1:4])
+        self.axis = [list(values[4:7]), list(values[7:10]),
+                list(values[10:13])]
+        return offset + self.packSize()
 
 class Md3Shader:
     def __init__(self):
         self.name = ""
         self.index = 0
-        self.fmt = "64s i"
+        self.fmt = SHADER_FMT
 
     def packSize(self):
         return struct.calcsize(self.fmt)
 
     def pack(self):
-        pack_str = ""
-        pack_str += struct.pack("64s", self.name)
-        pack_str += struct.pack("i", self.index)
+        return struct.pack(self.fmt, self.name, self.index)
+
+    def unpack(self, data, offset=0):
+        (name, self.index) = struct.unpack_from(self.fmt, data, offset)
+        self.name = name.split('\0', 1)[0]
+        return offset + self.packSize()
 
 class Md3Triangle:
     def __init__(self):
         self.indices = [0,0,0]
-        self.fmt = "iii"
+        self.fmt = TRIANGLE_FMT
 
     def packSize(self):
         return struct.calcsize(self.fmt)
 
     def pack(self):
-        return struct.pack("iii", self.indices.split())
+        return struct.pack(self.fmt, *self.indices)
 
 class Md3TexCoord:
     def __init__(self):
         self.uv_coords = [0,0]
-        self.fmt = "ff"
+        self.fmt = TEXCOORD_FMT
 
     def packSize(self):
         return struct.calcsize(self.fmt)
 
     def pack(self):
-        return struct.pack(self.fmt, self.uv_coords.split())
+        return struct.pack(self.fmt, *self.uv_coords)
 
 class Md3Vertex:
     def __init__(self):
         self.coord = [0,0,0]
         self.normal = [0,0]
-        self.factor = 1.0 / 64
-        self.fmt = "hhh BB"
+        self.factor = MD3_XYZ_SCALE
+        self.fmt = VERTEX_FMT
 
     def packSize(self):
         return struct.calcsize(self.fmt)
 
     def pack(self):
-        pack_str = ""
-        pack_str += struct.pack("hhh", self.coord.split())
-        pack_str += struct.pack("BB", self.normal.split())
-        return pack_str
+        return struct.pack(self.fmt, *(list(self.coord) + list(self.normal)))
 
     def scaleDown(self, coords):
         return [i * self.factor for i in coords]
 
 class Md3Surface:
+    """A surface with its triangles, texture coordinates and vertices kept in
+    flat arrays: three indices per triangle, two floats per texture
+    coordinate, and four shorts per vertex and frame (x, y, z and the
+    encoded normal).
+    """
     def __init__(self):
         self.ident = MD3_IDENT
         self.name = ""
+        self.flags = 0
         self.num_frames = 0
         self.num_shaders = 0
         self.num_verts = 0
         self.num_triangles = 0
         self.shaders = []
-        self.triangles = []
-        self.uv_coords = []
-        self.vertices = []
-        self.fmt = "4s 68s iiiiiiiii"
+        self.triangles = array.array(dom.INDEX_TYPE)
+        self.uv_coords = array.array(dom.FLOAT_TYPE)
+        self.vertices = array.array('h')
+        self.fmt = SURFACE_FMT
 
     def packSize(self):
-        size = struct.calcsize(self.fmt) 
-        size += len(self.shaders) * Md3Shader().packSize()
-        size += len(self.triangles) * Md3Triangle().packSize()
-        size += len(self.uv_coords) * Md3TexCoord().packSize()
-        size += len(self.vertices) * Md3Vertex().packSize()
+        size = struct.calcsize(self.fmt)
+        size += len(self.shaders) * struct.calcsize(SHADER_FMT)
+        size += self.num_triangles * struct.calcsize(TRIANGLE_FMT)
+        size += self.num_verts * struct.calcsize(TEXCOORD_FMT)
+        size += self.num_verts * self.num_frames * struct.calcsize(VERTEX_FMT)
         return size
 
+    def packHeader(self):
+        ofs_triangles = struct.calcsize(self.fmt)
+        ofs_shaders = ofs_triangles + \
+                self.num_triangles * struct.calcsize(TRIANGLE_FMT)
+        ofs_uv_coords = ofs_shaders + \
+                len(self.shaders) * struct.calcsize(SHADER_FMT)
+        ofs_vertices = ofs_uv_coords + \
+                self.num_verts * struct.calcsize(TEXCOORD_FMT)
+        ofs_end = self.packSize()
+        return struct.pack(self.fmt, self.ident, self.name, self.flags,
+                self.num_frames, len(self.shaders), self.num_verts,
+                self.num_triangles, ofs_triangles, ofs_shaders,
+                ofs_uv_coords, ofs_vertices, ofs_end)
+
     def pack(self):
-        pack_str = ""
-        pack_str += struct.pack("4s", self.ident)
-        pack_str += struct.pack("68s", self.name)
-        pack_str += struct.pack("ii", self.num_frames, self.num_shaders)
-        pack_str += struct.pack("ii", self.num_verts, self.num_triangles)
-        ofs_shaders = struct.calcsize(self.fmt)
-        ofs_triangles = ofs_shaders + len(self.shaders) * Md3Shader().packSize()
-        ofs_uv_coords = ofs_triangles + len(self.triangles) * Md3Triangle().packSize()
-        ofs_vertices = ofs_uv_coords + len(self.uv_coords) * Md3TexCoord().packSize()
-        ofs_end = ofs_vertices + len(self.vertices) * Md3Vertex().packSize()
-        pack_str += struct.pack("ii", ofs_triangles, ofs_shaders)
-        pack_str += struct.pack("iii", ofs_uv_coords, ofs_vertices, ofs_end)
+        pack_str = [self.packHeader(), packArray(self.triangles)]
         for shader in self.shaders:
-            pack_str += shader.pack()
-        for tri in self.triangles:
-            pack_str += tri.pack()
-        for texcoord in self.uv_coords:
-            pack_str += texcoord.pack()
-        for vert in self.vertices:
-            pack_str += vert.pack()
+            pack_str.append(shader.pack())
+        pack_str.append(packArray(self.uv_coords))
+        pack_str.append(packArray(self.vertices))
+        return "".join(pack_str)
+
+    def unpack(self, data, offset=0):
+        """Decode the surface at offset. The blocks are found through the
+        offsets in the surface header and decoded as whole arrays.
+        """
+        (self.ident, name, self.flags, self.num_frames, self.num_shaders,
+                self.num_verts, self.num_triangles, ofs_triangles,
+                ofs_shaders, ofs_uv_coords, ofs_vertices, ofs_end) = \
+                struct.unpack_from(self.fmt, data, offset)
+        self.name = name.split('\0', 1)[0]
+
+        self.shaders = []
+        shader_offset = offset + ofs_shaders
+        for i in xrange(self.num_shaders):
+            shader = Md3Shader()
+            shader_offset = shader.unpack(data, shader_offset)
+            self.shaders.append(shader)
+
+        self.triangles = unpackArray(dom.INDEX_TYPE, data,
+                offset + ofs_triangles, 3 * self.num_triangles)
+        self.uv_coords = unpackArray(dom.FLOAT_TYPE, data,
+                offset + ofs_uv_coords, 2 * self.num_verts)
+        self.vertices = unpackArray('h', data, offset + ofs_vertices,
+                4 * self.num_verts * self.num_frames)
+        return offset + ofs_end
 
 class MD3Object:
     def __init__(self):
         self.ident = MD3_IDENT
         self.version = MD3_VERSION
         self.name = ""
+        self.flags = 0
         self.num_frames = 0
         self.num_tags = 0
         self.num_surfaces = 0
@@ -200,46 +289,341 @@ class MD3Object:
         self.tags = []
         self.surfaces = []
 
+    def packHeader(self):
+        ofs_frames = struct.calcsize(HEADER_FMT)
+        ofs_tags = ofs_frames + len(self.frames) * struct.calcsize(FRAME_FMT)
+        ofs_surfaces = ofs_tags + len(self.tags) * struct.calcsize(TAG_FMT)
+        ofs_eof = ofs_surfaces
+        for surface in self.surfaces:
+            ofs_eof += surface.packSize()
+        return struct.pack(HEADER_FMT, self.ident, self.version, self.name,
+                self.flags, len(self.frames), len(self.tags),
+                len(self.surfaces), self.num_skins, ofs_frames, ofs_tags,
+                ofs_surfaces, ofs_eof)
+
     def pack(self):
-        pack_str = ""
-        fmt = "4si68siiiiiiii"
-        pack_str += struct.pack("4s", self.ident)
-        pack_str += struct.pack("i", self.version)
-        pack_str += struct.pack("68s", self.name)
-        pack_str += struct.pack("i", self.num_frames)
-        pack_str += struct.pack("i", self.num_tags)
-        pack_str += struct.pack("i", self.num_surfaces)
-        pack_str += struct.pack("i", self.num_skins)
-        ofs_frames = struct.calcsize(fmt)
-        ofs_tags = ofs_frames + len(self.frames) * Md3Frame().packSize()
-        ofs_surfaces = ofs_tags + len(self.tags) * Md3Tag().packSize()
-        ofs_eof = ofs_surfaces + len(self.surfaces) * Md3Surface().packSize()
-        pack_str += struct.pack("i", ofs_frames)
-        pack_str += struct.pack("i", ofs_tags)
-        pack_str += struct.pack("i", ofs_surfaces)
-        pack_str += struct.pack("i", ofs_eof)
+        pack_str = [self.packHeader()]
+        for frame in self.frames:
+            pack_str.append(frame.pack())
+        for tag in self.tags:
+            pack_str.append(tag.pack())
+        for surface in self.surfaces:
+            pack_str.append(surface.pack())
+        return "".join(pack_str)
+
+    def write(self, out):
+        """Write the object to out surface by surface
+        """
+        out.write(self.packHeader())
         for frame in self.frames:
-            pack_str += frame.pack()
+            out.write(frame.pack())
         for tag in self.tags:
-            pack_str += tag.pack()
+            out.write(tag.pack())
         for surface in self.surfaces:
-            pack_str += surface.pack()
-        return pack_str
+            out.write(surface.pack())
+
+def checkBlock(data, offset, count, item_fmt):
+    """Make sure "count" items of "item_fmt" at offset lie within data
+    """
+    if offset < 0 or count < 0 or \
+            offset + count * struct.calcsize(item_fmt) > len(data):
+        raise ValueError("truncated MD3 file")
+
+class Md3Reader:
+    """Random access to the frames, tags and surfaces of an MD3 file.
+    The file is memory mapped if possible, see toolbox.Source. Only the
+    headers are read up front, frames, tags and surfaces are decoded when
+    they are accessed. Raises ValueError if the data is not a complete MD3
+    file.
+    """
+    def __init__(self, asset):
+        self.source = toolbox.getSource(asset)
+        self.data = self.source.getBuffer()
+        try:
+            self.readIndex()
+        except ValueError:
+            self.close()
+            raise
+
+    def readIndex(self):
+        if len(self.data) < struct.calcsize(HEADER_FMT) or \
+                self.data[:4] != MD3_IDENT:
+            raise ValueError("not an MD3 file")
+
+        (self.ident, self.version, name, self.flags, self.num_frames,
+                self.num_tags, self.num_surfaces, self.num_skins,
+                self.ofs_frames, self.ofs_tags, self.ofs_surfaces,
+                self.ofs_eof) = struct.unpack_from(HEADER_FMT, self.data)
+        self.name = name.split('\0', 1)[0]
+
+        checkBlock(self.data, self.ofs_frames, self.num_frames, FRAME_FMT)
+        if self.num_tags < 0:
+            raise ValueError("truncated MD3 file")
+        checkBlock(self.data, self.ofs_tags, self.num_frames * self.num_tags,
+                TAG_FMT)
+
+        # offsets of the surfaces, chained through their ofs_end fields
+        self.index = []
+        offset = self.ofs_surfaces
+        if self.num_surfaces < 0:
+            raise ValueError("truncated MD3 file")
+        for i in xrange(self.num_surfaces):
+            self.checkSurface(offset)
+            self.index.append(offset)
+            (ofs_end,) = struct.unpack_from("<i", self.data,
+                    offset + struct.calcsize(SURFACE_FMT) - 4)
+            offset += ofs_end
+
+    def checkSurface(self, offset):
+        """Make sure the surface at offset and all its blocks lie within the
+        data
+        """
+        checkBlock(self.data, offset, 1, SURFACE_FMT)
+        (ident, name, flags, num_frames, num_shaders, num_verts,
+                num_triangles, ofs_triangles, ofs_shaders, ofs_uv_coords,
+                ofs_vertices, ofs_end) = \
+                struct.unpack_from(SURFACE_FMT, self.data, offset)
+        if ofs_end < struct.calcsize(SURFACE_FMT) or num_verts < 0 or \
+                offset + ofs_end > len(self.data):
+            raise ValueError("truncated MD3 file")
+        checkBlock(self.data, offset + ofs_triangles, num_triangles,
+                TRIANGLE_FMT)
+        checkBlock(self.data, offset + ofs_shaders, num_shaders, SHADER_FMT)
+        checkBlock(self.data, offset + ofs_uv_coords, num_verts,
+                TEXCOORD_FMT)
+        checkBlock(self.data, offset + ofs_vertices, num_verts * num_frames,
+                VERTEX_FMT)
+
+    def getNumFrames(self):
+        return self.num_frames
+
+    def getFrame(self, index):
+        """Decode frame number "index"
+        """
+        frame = Md3Frame()
+        frame.unpack(self.data, self.ofs_frames + index * frame.packSize())
+        return frame
+
+    def getNumTags(self):
+        return self.num_tags
+
+    def getTag(self, index, frame=0):
+        """Decode tag number "index" of a frame
+        """
+        tag = Md3Tag()
+        tag.unpack(self.data, self.ofs_tags +
+                (frame * self.num_tags + index) * tag.packSize())
+        return tag
+
+    def getNumSurfaces(self):
+        return len(self.index)
+
+    def getSurface(self, index):
+        """Decode surface number "index"
+        """
+        surface = Md3Surface()
+        surface.unpack(self.data, self.index[index])
+        return surface
+
+    def getSurfaces(self):
+        for i in xrange(self.getNumSurfaces()):
+            yield self.getSurface(i)
+
+    def close(self):
+        self.data = None
+        self.source.close()
+
+def quantizePositions(positions):
+    """Convert a flat array of positions to MD3 fixed point shorts in one
+    pass. Coordinates outside the representable range are clamped.
+    """
+    if positions and (max(positions) > MD3_MAX_COORD or
+            min(positions) < MD3_MIN_COORD):
+        print >> sys.stderr, "Warning: MD3 coordinates are limited to " \
+                "[%s, %s], clamping" % (MD3_MIN_COORD, MD3_MAX_COORD)
+        positions = [min(max(v, MD3_MIN_COORD), MD3_MAX_COORD)
+                for v in positions]
+    scale = 1 / MD3_XYZ_SCALE
+    return array.array('h', [int(round(v * scale)) for v in positions])
+
+def encodeNormals(vectors):
+    """Encode a flat array of normals into MD3 normal codes, azimuth in the
+    high byte and zenith in the low byte of a short. Angles are rounded to
+    the closest step, so decoded normals encode to the same code again.
+    """
+    if vectors and (max(vectors) > 1.0 or min(vectors) < -1.0):
+        vectors = normals.normalize(vectors)
+
+    # 255 steps make a full turn, so negative azimuths wrap around by 255
+    scale = 255 / (2 * math.pi)
+    atan2 = math.atan2
+    acos = math.acos
+    codes = array.array('H', [
+            int(round(atan2(y, x) * scale)) % 255 << 8 |
+            int(round(acos(max(-1.0, min(z, 1.0))) * scale)) & 255
+            for (x, y, z) in zip(vectors[0::3], vectors[1::3], vectors[2::3])])
+    # the vertex array holds signed shorts
+    return array.array('h', codes.tostring())
+
+# Lookup tables for decoding normals, built on first use. They hold the x, y
+# and z components for all 256x256 azimuth/zenith combinations.
+decode_tables = None
+
+def buildDecodeTables():
+    global decode_tables
+    step = 2 * math.pi / 255
+    sines = [math.sin(i * step) for i in range(256)]
+    cosines = [math.cos(i * step) for i in range(256)]
+    x_table = array.array(dom.FLOAT_TYPE)
+    y_table = array.array(dom.FLOAT_TYPE)
+    z_table = array.array(dom.FLOAT_TYPE, cosines) * 256
+    for azimuth in range(256):
+        x_table.extend([cosines[azimuth] * sines[zenith]
+                for zenith in range(256)])
+        y_table.extend([sines[azimuth] * sines[zenith]
+                for zenith in range(256)])
+    decode_tables = (x_table, y_table, z_table)
+
+def decodeNormals(codes):
+    """Decode an array of MD3 normal codes into a flat array of normals
+    """
+    if decode_tables is None:
+        buildDecodeTables()
+    result = array.array(dom.FLOAT_TYPE, [0]) * (3 * len(codes))
+    # The codes are signed shorts, negative indices wrap around to the
+    # upper half of the tables just like the unsigned value would.
+    for (i, table) in enumerate(decode_tables):
+        result[i::3] = array.array(dom.FLOAT_TYPE,
+                [table[code] for code in codes])
+    return result
+
+def domMesh(surface, frame=0):
+    """Create a DOM mesh from one frame of an Md3Surface
+    """
+    start = 4 * surface.num_verts * frame
+    vertices = surface.vertices[start:start + 4 * surface.num_verts]
+    coords = array.array('h', [0]) * (3 * surface.num_verts)
+    for i in range(3):
+        coords[i::3] = vertices[i::4]
+    positions = array.array(dom.FLOAT_TYPE,
+            [v * MD3_XYZ_SCALE for v in coords])
+
+    mesh = dom.Mesh.fromArrays(positions, decodeNormals(vertices[3::4]),
+            surface.uv_coords, surface.triangles)
+    mesh.materials = dom.Materials()
+    mesh.materials.parent = mesh
+    material = dom.Material()
+    material.parent = mesh.materials
+    mesh.materials.materials.append(material)
+    if surface.shaders:
+        material.path = surface.shaders[0].name
+    return mesh
+
+def surfaceBounds(surface):
+    """Get the (min, max) bounds of the vertices of a surface, or None if it
+    has no vertices
+    """
+    if not surface.vertices:
+        return None
+    axes = [surface.vertices[i::4] for i in range(3)]
+    return ([min(axis) * MD3_XYZ_SCALE for axis in axes],
+            [max(axis) * MD3_XYZ_SCALE for axis in axes])
+
+def md3Surface(mesh, name):
+    """Create an Md3Surface holding the first and only frame of a mesh.
+    Vertex normals are generated if the mesh lacks them, missing texture
+    coordinates are written as zeros.
+    """
+    surface = Md3Surface()
+    surface.name = name
+    surface.num_frames = 1
+    surface.num_verts = mesh.getNumVertices()
+    surface.num_triangles = mesh.getNumFaces()
+    if surface.num_verts > MD3_MAX_VERTS or \
+            surface.num_triangles > MD3_MAX_TRIANGLES:
+        print >> sys.stderr, "Warning: surface '%s' exceeds the MD3 limits " \
+                "of %s vertices and %s triangles" % (name, MD3_MAX_VERTS,
+                MD3_MAX_TRIANGLES)
+
+    shader = Md3Shader()
+    if mesh.getMaterials():
+        shader.name = mesh.getMaterials()[0].getPath()
+    surface.shaders.append(shader)
+    surface.num_shaders = len(surface.shaders)
+
+    (positions, vertex_normals, uv_coords, indices) = mesh.toArrays()
+    surface.triangles = indices
+    surface.uv_coords = uv_coords
+    if len(uv_coords) != 2 * surface.num_verts:
+        surface.uv_coords = array.array(dom.FLOAT_TYPE, [0]) * \
+                (2 * surface.num_verts)
+    if len(vertex_normals) != len(positions):
+        vertex_normals = normals.accumulate(surface.num_verts, indices,
+                normals.faceNormals(positions, indices))
+
+    # interleave x, y, z and the normal code of every vertex
+    coords = quantizePositions(positions)
+    vertices = array.array('h', [0]) * (4 * surface.num_verts)
+    for i in range(3):
+        vertices[i::4] = coords[i::3]
+    vertices[3::4] = encodeNormals(vertex_normals)
+    surface.vertices = vertices
+    return surface
+
+def md3Frame(surfaces, name="frame0"):
+    """Create the frame enclosing all surfaces. The local origin is the
+    center of the bounding box, the radius reaches its corners.
+    """
+    frame = Md3Frame()
+    frame.name = name
+    bounds = [b for b in map(surfaceBounds, surfaces) if b]
+    if bounds:
+        frame.min_bounds = [min([b[0][i] for b in bounds]) for i in range(3)]
+        frame.max_bounds = [max([b[1][i] for b in bounds]) for i in range(3)]
+    frame.local_origin = [(low + high) / 2.0
+            for (low, high) in zip(frame.min_bounds, frame.max_bounds)]
+    frame.radius = math.sqrt(sum([((high - low) / 2.0) ** 2
+            for (low, high) in zip(frame.min_bounds, frame.max_bounds)]))
+    return frame
+
+def sniff(header):
+    """Check if data starting with "header" is an MD3 file
+    """
+    return header.startswith(MD3_IDENT)
 
 def importAsset(model, asset):
-    raise NotImplementedError
+    try:
+        with instrument.span("read") as span:
+            reader = Md3Reader(asset)
+            span.count(bytes=len(reader.data))
+    except ValueError, e:
+        print "'%s' is not a valid MD3 file: %s" % (asset, e)
+        sys.exit(1)
+
+    model.meshes = dom.Meshes()
+    with instrument.span("decode") as span:
+        for surface in reader.getSurfaces():
+            mesh = domMesh(surface)
+            mesh.parent = model.meshes
+            model.meshes.meshes.append(mesh)
+        span.countMeshes(model.getMeshes())
+
+    reader.close()
 
 def exportAsset(model, asset):
     out = toolbox.writeAny(asset)
     md3_object = MD3Object()
     meshes = model.getMeshes()
-    #TODO: Put stuff into the MD3Object here()
-    out.write(md3_object.pack())
-    out.close()
-
-def encodeNormal(x,y,z):
-    """Returns (azimuth, zenith) angles of the normal vector
-    """
-    azimuth = math.atan2(y, x) * 255 / (2 * math.pi)
-    zenith = math.acos(z) * 255 / (2 * math.pi)
-    return (azimuth, zenith)
+    if len(meshes) > MD3_MAX_SURFACES:
+        print >> sys.stderr, "Warning: MD3 files are limited to %s surfaces" \
+                % MD3_MAX_SURFACES
+    with instrument.span("encode") as span:
+        for i, mesh in enumerate(meshes):
+            md3_object.surfaces.append(md3Surface(mesh, "surface%d" % i))
+        md3_object.frames.append(md3Frame(md3_object.surfaces))
+        span.countMeshes(meshes)
+    md3_object.num_frames = len(md3_object.frames)
+    md3_object.num_surfaces = len(md3_object.surfaces)
+    with instrument.span("write"):
+        md3_object.write(out)
+        out.close()
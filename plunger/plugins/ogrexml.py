@@ -23,10 +23,12 @@ The module supports import and export.
 import sys
 
 try:
-    from plunger import toolbox
+    from plunger import toolbox, dom, instrument
 except ImportError:
     sys.path.append("..")
     import toolbox
+    import dom
+    import instrument
     sys.path.pop()
 
 from ogrexml_plugin.parser import Parser
@@ -39,20 +41,32 @@ does_import = True
 does_export = True
 version = "0.1.0"
 
+def sniff(header):
+    """Check if data starting with "header" is an Ogre mesh.xml document
+    """
+    return toolbox.getRootElement(header) == "mesh"
+
 def importAsset(model, asset):
     """Import a mesh.xml object
     """
-    from xml.dom import minidom
     sock = toolbox.openAny(asset)
-    xmldom = minidom.parse(sock)
-    sock.close()
     p = Parser(model)
-    p.parse(xmldom)
+    with instrument.span("parse") as span:
+        p.parse(sock)
+        span.countMeshes(model.getMeshes())
+    sock.close()
 
-def exportAsset(model, asset):
-    g = Generator()
-    g.generate(model)
+def importMeshes(asset):
+    """Yield the submeshes of a mesh.xml object one by one, as they are
+    parsed
+    """
+    sock = toolbox.openAny(asset)
+    p = Parser(dom.Model())
+    for mesh in p.parseMeshes(sock):
+        yield mesh
+    sock.close()
 
+def exportAsset(model, asset):
     import sys
     file = None
     try:
@@ -61,10 +75,31 @@ def exportAsset(model, asset):
         print "Failed to open '%s' for writing" % asset
         sys.exit(1)
 
+    g = Generator(out=file)
     try:
-        file.write(g.toxml())
-        file.close()
+        with instrument.span("generate"):
+            g.generate(model)
+        with instrument.span("write"):
+            g.flush()
+            file.close()
     except IOError:
         print "Writing '%s' failed." % asset
         sys.exit(1)
 
+def exportMeshes(meshes, asset):
+    file = None
+    try:
+        file = toolbox.writeAny(asset)
+    except IOError:
+        print "Failed to open '%s' for writing" % asset
+        sys.exit(1)
+
+    g = Generator(out=file)
+    try:
+        g.generateMeshes(meshes)
+        with instrument.span("write"):
+            g.flush()
+            file.close()
+    except IOError:
+        print "Writing '%s' failed." % asset
+        sys.exit(1)
@@ -18,9 +18,27 @@
 """Generate mesh.xml files for Ogre3D.
 """
 
+import StringIO
+
+try:
+    from plunger import instrument
+    from plunger import toolbox
+except ImportError:
+    import sys
+    sys.path.append("../..")
+    import instrument
+    import toolbox
+    sys.path.pop()
+
 class Generator:
-    def __init__(self, indent_depth=4):
-        self.out_string = ""
+    """Write the generated XML to the stream "out" as it is generated.
+    Without a stream, the XML is kept in memory and returned by toxml().
+    """
+    def __init__(self, indent_depth=4, out=None):
+        if out is None:
+            out = StringIO.StringIO()
+        self.out = out
+        self.writer = toolbox.BufferedWriter(out)
         self.indent_depth = indent_depth
 
     def indent(self, depth):
@@ -28,7 +46,12 @@ class Generator:
         self.append(indent_string)
 
     def append(self, string):
-        self.out_string += string
+        self.writer.write(string)
+
+    def flush(self):
+        """Write out everything that is still buffered
+        """
+        self.writer.flush()
 
     def appendIfAttr(self, node, attr):
         obj_attr = getattr(node, attr, None)
@@ -36,7 +59,8 @@ class Generator:
             self.append(' %s="%s"' % (attr, obj_attr))
 
     def toxml(self):
-        return self.out_string
+        self.flush()
+        return self.out.getvalue()
 
     def generate(self, node, depth=0):
         if not node:
@@ -84,13 +108,21 @@ class Generator:
     def do_Model(self, node, depth):
         """The Model object maps to the <mesh> tag.
         """
+        self.generateMeshes(node.getMeshes(), depth)
+
+    def generateMeshes(self, meshes, depth=0):
+        """Generate a <mesh> tag for the meshes of an iterable, writing out
+        every submesh before the next one is taken from "meshes"
+        """
         self.indent(depth)
         self.append("<mesh>\n")
 
         self.indent(depth+1)
         self.append("<submeshes>\n")
-        for mesh in node.getMeshes():
-            self.generate(mesh, depth+2)
+        for mesh in meshes:
+            with instrument.span("generate"):
+                self.generate(mesh, depth+2)
+                self.flush()
         self.indent(depth+1)
         self.append("</submeshes>\n")
 
@@ -105,21 +137,24 @@ class Generator:
         self.indent(depth)
         self.append('<vertex>\n')
 
+        fmt = toolbox.formatFloat
         self.indent(depth+1)
         self.append('<position x="%s" y="%s" z="%s" />\n' %
-                (node.getPosition()[0], node.getPosition()[2], node.getPosition()[1] * -1.0))
+                (fmt(node.getPosition()[0]), fmt(node.getPosition()[2]),
+                fmt(node.getPosition()[1] * -1.0)))
 
         if node.getNormals():
             self.indent(depth+1)
             self.append('<normal x="%s" y="%s" z="%s" />\n' %
-                (node.getNormals()[0], node.getNormals()[2], node.getNormals()[1] * -1.0))
+                (fmt(node.getNormals()[0]), fmt(node.getNormals()[2]),
+                fmt(node.getNormals()[1] * -1.0)))
 
         if node.getUVCoords():
             self.indent(depth+1)
-            self.append('<texcoord u="%s" v="%s"' % (node.getUVCoords()[0],
-                node.getUVCoords()[1]))
+            self.append('<texcoord u="%s" v="%s"' %
+                (fmt(node.getUVCoords()[0]), fmt(node.getUVCoords()[1])))
             if len(node.getUVCoords()) == 3:
-                self.append(' w="%s"'% node.getUVCoords()[2])
+                self.append(' w="%s"'% fmt(node.getUVCoords()[2]))
             self.append(' />\n')
 
         self.indent(depth)
@@ -16,83 +16,195 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
 """Parser for the Ogre3D mesh.xml format.
+
+The parser is driven by expat events. The vertex attributes and indices are
+stored in arrays allocated for the vertexcount and count of the <geometry>
+and <faces> tags, and no XML tree is ever built.
 """
 
+import array
+import operator
+from xml.parsers import expat
+
 try:
     from plunger import dom
+    from plunger import instrument
+    from plunger import normals
 except ImportError:
     import sys
     sys.path.append("../..")
     import dom
+    import instrument
+    import normals
     sys.path.pop()
 
-def addAttr(obj, node, attr, convert_fun=lambda x: x):
-    """Add attribute "attr" to object "obj" if it exists in node "node".
-    If convert_fun is specified, use it to convert the nodeValue.
+def zeroArray(typecode, count):
+    return array.array(typecode, [0]) * count
+
+def storeValues(values, pos, attrs, names, convert_fun=float):
+    """Store the attributes "names" of the attribute dict "attrs" in values,
+    starting at pos. values grows if the count given in the file was too low.
+    Returns the position after the stored values.
+    """
+    end = pos + len(names)
+    if end > len(values):
+        values.extend(zeroArray(values.typecode, end - len(values)))
+    for name in names:
+        values[pos] = convert_fun(attrs[name])
+        pos += 1
+    return end
+
+def swapAxes(values):
+    """Turn the x, y, z triples in "values" from Ogre's "z is up" into
+    plunger's "y is up" x, -z, y, all at once
+    """
+    y_values = values[1::3]
+    values[1::3] = array.array(values.typecode,
+            map(operator.neg, values[2::3]))
+    values[2::3] = y_values
+
+class Geometry:
+    """Model <geometry> tags, whose vertex attributes are stored as they are
+    read, in arrays allocated for vertexcount vertices
     """
-    if attr in node.attributes.keys():
-        setattr(obj, attr, convert_fun(node.attributes[attr].nodeValue))
+    def __init__(self, mesh, count):
+        self.mesh = mesh
+        self.positions = zeroArray(dom.FLOAT_TYPE, 3 * count)
+        self.normals = zeroArray(dom.FLOAT_TYPE, 3 * count)
+        self.uv_coords = zeroArray(dom.FLOAT_TYPE, 2 * count)
+        # number of values stored in each array
+        self.num_positions = 0
+        self.num_normals = 0
+        self.num_uv_coords = 0
+        # set once the current <vertex> has a <texcoord>
+        self.has_texcoord = False
+
+class Faces:
+    """Model <faces> tags, whose indices are stored as they are read, in an
+    array allocated for count faces
+    """
+    def __init__(self, mesh, count):
+        self.mesh = mesh
+        self.indices = zeroArray(dom.INDEX_TYPE, 3 * count)
+        self.num_indices = 0
 
 class Parser:
     """Parse Ogre3D mesh.xml files
+
+    For every element, start_<tag>(attrs, parent) is called when it is opened.
+    It returns the object its children are parsed into, or None to skip the
+    whole subtree. Elements without a start_<tag> function are skipped with a
+    warning. If present, end_<tag>(obj) is called when the element is closed.
     """
 
     def __init__(self, model):
         self.model = model
-
-    def parse(self, node, parent=None):
-        """Dispatch the correct parser for the node to parse
+        self.stack = []
+        self.skip_depth = 0
+        self.start_handlers = {}
+        self.end_handlers = {}
+        # with keep_meshes unset, finished meshes are moved from the model to
+        # finished_meshes, see parseMeshes()
+        self.keep_meshes = True
+        self.finished_meshes = []
+
+    def createParser(self):
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        return parser
+
+    def parse(self, stream, chunk_size=65536):
+        """Parse the mesh.xml document read from "stream", chunk by chunk
         """
-        parse_fun = getattr(self, "parse%s" % node.__class__.__name__)
-        parse_fun(node, parent)
-
-    def parseChildNodes(self, node, parent):
-        """Parse all child nodes of the given node
+        parser = self.createParser()
+
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            parser.Parse(data, False)
+        parser.Parse("", True)
+
+    def parseMeshes(self, stream, chunk_size=65536):
+        """Parse the mesh.xml document read from "stream", yielding every
+        submesh once its <submesh> tag is closed. The meshes are not kept in
+        the model.
         """
-        for child in node.childNodes:
-            self.parse(child, parent)
-
-    def parseComment(self, node, parent):
-        """Ignore comments
+        self.keep_meshes = False
+        parser = self.createParser()
+
+        while True:
+            data = stream.read(chunk_size)
+            with instrument.span("parse") as span:
+                parser.Parse(data, not data)
+                span.count(bytes=len(data))
+            for mesh in self.finished_meshes:
+                yield mesh
+            self.finished_meshes = []
+            if not data:
+                break
+
+    def getStartHandler(self, name):
+        if name not in self.start_handlers:
+            self.start_handlers[name] = getattr(self, "start_%s" % name,
+                    None)
+        return self.start_handlers[name]
+
+    def getEndHandler(self, name):
+        if name not in self.end_handlers:
+            self.end_handlers[name] = getattr(self, "end_%s" % name, None)
+        return self.end_handlers[name]
+
+    def startElement(self, name, attrs):
+        """Dispatch the correct function to handle the opened tag
         """
-        pass
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
 
-    def parseDocument(self, node, parent):
-        """The document contains a documentElement, so parse that.
-        """
-        self.parse(node.documentElement)
+        parent = None
+        if self.stack:
+            parent = self.stack[-1][1]
 
-    def parseElement(self, node, parent):
-        """Dispatch a function to handle whatever tag node contains
-        """
-        handler_fun = getattr(self, "do_%s" % node.tagName, self.do_nyi)
-        handler_fun(node, parent)
+        handler = self.getStartHandler(name)
+        if handler:
+            obj = handler(attrs, parent)
+        else:
+            print "WARNING: unimplemented tag %s!" % name
+            obj = None
+        if obj is None:
+            self.skip_depth = 1
+            return
 
-    def parseText(self, node, parent):
-        """Ignore text
-        """
-        pass
+        self.stack.append((name, obj))
 
-    def do_nyi(self, node, parent):
-        """Handle unimplemented functions
+    def endElement(self, name):
+        """Dispatch the correct function to handle the closed tag
         """
-        print "WARNING: unimplemented tag %s!" % node.tagName
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+
+        obj = self.stack.pop()[1]
+        handler = self.getEndHandler(name)
+        if handler:
+            handler(obj)
 
-    def do_mesh(self, node, parent):
+    def start_mesh(self, attrs, parent):
         """Handle the <mesh> tag, which is the root node of ogre's mesh.xml
         """
-        self.parseChildNodes(node, self.model)
+        return self.model
 
-    def do_submeshes(self, node, parent):
+    def start_submeshes(self, attrs, parent):
         """Handle the <submeshes> tag, which groups all the meshes in the model.
         """
         meshes = dom.Meshes()
         meshes.parent = parent
         parent.meshes = meshes
+        return meshes
 
-        self.parseChildNodes(node, meshes)
-
-    def do_submesh(self, node, parent):
+    def start_submesh(self, attrs, parent):
         """Handle the <submesh> tag, which contains one mesh for the model.
         """
         mesh = dom.Mesh()
@@ -107,97 +219,95 @@ class Parser:
         material.parent = materials
         materials.materials.append(material)
 
-        if "material" in node.attributes.keys():
-            material.path = str(node.attributes["material"].nodeValue)
+        if "material" in attrs:
+            material.path = str(attrs["material"])
+        return mesh
 
-        self.parseChildNodes(node, mesh)
+    def end_submesh(self, mesh):
+        """Generate missing normals of the finished <submesh> tag
+        """
+        if normals.needsNormals(mesh):
+            normals.generateNormals(mesh)
 
-    def do_faces(self, node, parent):
+        if not self.keep_meshes:
+            mesh.parent.meshes.remove(mesh)
+            mesh.parent = None
+            self.finished_meshes.append(mesh)
+
+    def start_faces(self, attrs, parent):
         """Handle the <faces> tag, which groups the faces for the mesh
         """
-        faces = dom.Faces()
-        faces.parent = parent
-        parent.faces = faces
+        return Faces(parent, int(attrs.get("count", 0)))
+
+    def end_faces(self, faces):
+        """Store the indices of the finished <faces> tag in its mesh
+        """
+        del faces.indices[faces.num_indices:]
+        faces.mesh.indices.extend(faces.indices)
 
-        self.parseChildNodes(node, faces)
+    def start_face(self, attrs, faces):
+        """Handle the <face> tag
+        """
+        faces.num_indices = storeValues(faces.indices, faces.num_indices,
+                attrs, ("v1", "v2", "v3"), int)
+        return faces
 
-    def do_geometry(self, node, parent):
+    def start_geometry(self, attrs, parent):
         """Handle the <geometry> tag, which groups vertex buffers
         """
-        self.parseChildNodes(node, parent)
+        return Geometry(parent, int(attrs.get("vertexcount", 0)))
 
-    def do_vertexbuffer(self, node, parent):
+    def end_geometry(self, geometry):
+        """Store the vertex attributes of the finished <geometry> tag in its
+        mesh. Ogre uses "z is up", whereas plunger uses "y is up", so
+        positions and normals are turned around once for all vertices.
+        """
+        del geometry.positions[geometry.num_positions:]
+        del geometry.normals[geometry.num_normals:]
+        del geometry.uv_coords[geometry.num_uv_coords:]
+        swapAxes(geometry.positions)
+        swapAxes(geometry.normals)
+
+        mesh = geometry.mesh
+        mesh.positions.extend(geometry.positions)
+        mesh.normals.extend(geometry.normals)
+        mesh.uv_coords.extend(geometry.uv_coords)
+
+    def start_vertexbuffer(self, attrs, geometry):
         """Handle the <vertexbuffer> tag
         """
-        # NOTE: I'll stuff all <vertexbuffer>s into one Vertices object
-        vertices = None
-        if parent.vertices:
-            vertices = parent.vertices
-            vertices.initial = False
-        else:
-            vertices = dom.Vertices()
-            parent.vertices = vertices
-            vertices.parent = parent
-            vertices.initial = True
-
+        # NOTE: Every <vertexbuffer> appends to the geometry's attribute
+        # buffers, so buffers holding different attributes end up in one set
+        # of vertices.
         #FIXME: figure out how to handle the attributes, maybe
-        vertices.vcount = 0
+        return geometry
 
-        self.parseChildNodes(node, vertices)
-
-    def do_vertex(self, node, parent):
+    def start_vertex(self, attrs, geometry):
         """Handle the <vertex> tag
         """
-        vertex = None
-        if parent.initial:
-            vertex = dom.Vertex()
-            vertex.parent = parent
-            parent.vertices.append(vertex)
-        else:
-            vertex = parent.vertices[parent.vcount]
-            parent.vcount += 1
-
-        self.parseChildNodes(node, vertex)
-
-    def do_position(self, node, parent):
-        """Handle the <position> tag
-        Note that Ogre uses "z is up", whereas plunger uses "y is up"
-        """
-        position = []
-        position.append(float(node.attributes['x'].nodeValue))
-        position.append(float(node.attributes['z'].nodeValue) * -1.0)
-        position.append(float(node.attributes['y'].nodeValue))
-        parent.position = position
+        geometry.has_texcoord = False
+        return geometry
 
-    def do_normal(self, node, parent):
-        """Handle the <normal>
-        Note that Ogre uses "z is up", whereas plunger uses "y is up"
+    def start_position(self, attrs, geometry):
+        """Handle the <position> tag, see end_geometry() for its axes
         """
-        normal = []
-        normal.append(float(node.attributes['x'].nodeValue))
-        normal.append(float(node.attributes['z'].nodeValue) * -1.0)
-        normal.append(float(node.attributes['y'].nodeValue))
-        parent.normals = normal
+        geometry.num_positions = storeValues(geometry.positions,
+                geometry.num_positions, attrs, ("x", "y", "z"))
+        return geometry
 
-    def do_texcoord(self, node, parent):
-        """Handle the first <texcoord> tag
+    def start_normal(self, attrs, geometry):
+        """Handle the <normal> tag, see end_geometry() for its axes
         """
-        #FIXME: This only works if there's one texcoord tag for now
-        texcoord = []
-        texcoord.append(float(node.attributes['u'].nodeValue))
-        texcoord.append(float(node.attributes['v'].nodeValue))
-        parent.uv_coords = texcoord
+        geometry.num_normals = storeValues(geometry.normals,
+                geometry.num_normals, attrs, ("x", "y", "z"))
+        return geometry
 
-    def do_face(self, node, parent):
-        """Handle the <face> tag
+    def start_texcoord(self, attrs, geometry):
+        """Handle the first <texcoord> tag of a vertex
         """
-        face = dom.Face()
-        face.parent = parent
-        parent.faces.append(face)
-
-        vlist = []
-        vlist.append(int(node.attributes['v1'].nodeValue))
-        vlist.append(int(node.attributes['v2'].nodeValue))
-        vlist.append(int(node.attributes['v3'].nodeValue))
-        face.vertex_list = vlist
-
+        #FIXME: Further texture coordinate sets are ignored for now
+        if not geometry.has_texcoord:
+            geometry.num_uv_coords = storeValues(geometry.uv_coords,
+                    geometry.num_uv_coords, attrs, ("u", "v"))
+            geometry.has_texcoord = True
+        return geometry
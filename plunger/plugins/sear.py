@@ -20,16 +20,19 @@
 The module supports export and import.
 """
 
-import sys
+import array
 import struct
+import sys
 
 try:
     from plunger import toolbox
     from plunger import dom
+    from plunger import instrument
 except ImportError:
     sys.path.append("..")
     import toolbox
     import dom
+    import instrument
     sys.path.pop()
 
 format = "sear"
@@ -39,9 +42,51 @@ does_import = True
 does_export = True
 version = "1"
 
+# First bytes of every Sear object file
+SEAR_MAGIC = "SEARSTAT"
+
+# Sear objects are written in the byte order of the machine writing them,
+# the byte_order field tells which one it was.
+BYTE_ORDER_MARK = 0xFF00
+if sys.byteorder == "little":
+    NATIVE_ENDIAN = "<"
+else:
+    NATIVE_ENDIAN = ">"
+
+# Offset of num_vertices/num_faces and size of the fixed part of a mesh
+MESH_COUNTS_OFFSET = struct.calcsize("<16f 16f 256s")
+MESH_HEADER_SIZE = struct.calcsize("<16f 16f 256s II 4f 4f 4f 4f f")
+# Bytes per vertex (position, normal, texture coords) and per face
+VERTEX_SIZE = struct.calcsize("<3f 3f 2f")
+FACE_SIZE = struct.calcsize("<3I")
+
+def unpackArray(typecode, data, offset, count, endian=NATIVE_ENDIAN):
+    """Decode "count" values of "typecode" at offset in one go, without
+    copying them out of data first.
+    """
+    values = array.array(typecode)
+    block = buffer(data, offset, count * values.itemsize)
+    if len(block) != count * values.itemsize:
+        raise ValueError("truncated Sear object file")
+    values.fromstring(block)
+    if endian != NATIVE_ENDIAN:
+        values.byteswap()
+    return values
+
+def writeArray(out, values):
+    """Write an array to out in one go
+    """
+    if isinstance(out, file):
+        values.tofile(out)
+    else:
+        out.write(values.tostring())
+
+def zeroArray(typecode, count):
+    return array.array(typecode, [0]) * count
+
 class SearObjectHeader:
     def __init__(self):
-        self.magic = 'SEARSTAT'
+        self.magic = SEAR_MAGIC
         self.byte_order = 0xFF00
         self.version = 1
         self.num_meshes = 0
@@ -51,11 +96,20 @@ class SearObjectHeader:
                 self.num_meshes)
 
     def unpack(self, data, offset=0):
-        fmt_string = "8sHBI"
-        fmt_string_size = struct.calcsize(fmt_string)
+        if len(data) < offset + struct.calcsize("8sHBxI") or \
+                data[offset:offset + len(SEAR_MAGIC)] != SEAR_MAGIC:
+            raise ValueError("not a Sear object file")
+
+        (byte_order,) = struct.unpack_from("<H", data, offset + 8)
+        if byte_order == BYTE_ORDER_MARK:
+            self.endian = "<"
+        else:
+            self.endian = ">"
+
+        fmt_string = self.endian + "8sHBxI"
         (self.magic, self.byte_order, self.version, self.num_meshes) =\
-            struct.unpack(fmt_string, data[:fmt_string_size])
-        return offset + fmt_string_size
+            struct.unpack_from(fmt_string, data, offset)
+        return offset + struct.calcsize(fmt_string)
 
 class SearObjectMesh:
     def __init__(self):
@@ -69,112 +123,79 @@ class SearObjectMesh:
         self.specular = [0,0,0,1]
         self.emissive = [0,0,0,1]
         self.shininess = 1
-        self.vertices = []
-        self.normals = []
-        self.texture_coords = []
-        self.indices = []
+        self.vertices = array.array(dom.FLOAT_TYPE)
+        self.normals = array.array(dom.FLOAT_TYPE)
+        self.texture_coords = array.array(dom.FLOAT_TYPE)
+        self.indices = array.array(dom.INDEX_TYPE)
 
-    def pack(self):
-        pack_str = ""
+    def packSize(self):
+        return MESH_HEADER_SIZE + self.num_vertices * VERTEX_SIZE + \
+                self.num_faces * FACE_SIZE
+
+    def packHeader(self):
+        values = []
         for row in self.mesh_transform:
-            for item in row:
-                pack_str += struct.pack("f", item)
+            values.extend(row)
         for row in self.texture_transform:
-            for item in row:
-                pack_str += struct.pack("f", item)
-        pack_str += struct.pack("256s", self.texture_map)
-        pack_str += struct.pack("II", self.num_vertices, self.num_faces)
-        pack_str += struct.pack("ffff", self.ambient[0], self.ambient[1],
-                self.ambient[2], self.ambient[3])
-        pack_str += struct.pack("ffff", self.diffuse[0], self.diffuse[1],
-                self.diffuse[2], self.diffuse[3])
-        pack_str += struct.pack("ffff", self.specular[0], self.specular[1],
-                self.specular[2], self.specular[3])
-        pack_str += struct.pack("ffff", self.emissive[0], self.emissive[1],
-                self.emissive[2], self.emissive[3])
-        pack_str += struct.pack("f", self.shininess)
-        for vertex in self.vertices:
-            pack_str += struct.pack("fff", vertex[0], vertex[1], vertex[2])
-        for normal in self.normals:
-            pack_str += struct.pack("fff", normal[0], normal[1], normal[2])
-        for coord in self.texture_coords:
-            pack_str += struct.pack("ff", coord[0], coord[1])
-        for index in self.indices:
-            pack_str += struct.pack("III", index[0], index[1], index[2])
-
-        return pack_str
-
-    def unpack(self, data, offset=0):
-        fmt = "ffff ffff ffff ffff"
-        fmt_size = struct.calcsize(fmt)
+            values.extend(row)
+        values.append(self.texture_map)
+        values.extend((self.num_vertices, self.num_faces))
+        values.extend(self.ambient)
+        values.extend(self.diffuse)
+        values.extend(self.specular)
+        values.extend(self.emissive)
+        values.append(self.shininess)
+        return struct.pack("16f 16f 256s II 4f 4f 4f 4f f", *values)
 
-        trans = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
+    def pack(self):
+        return self.packHeader() + self.vertices.tostring() + \
+                self.normals.tostring() + self.texture_coords.tostring() + \
+                self.indices.tostring()
+
+    def write(self, out):
+        """Write the mesh to "out", one attribute block at a time
+        """
+        out.write(self.packHeader())
+        for values in (self.vertices, self.normals, self.texture_coords,
+                self.indices):
+            writeArray(out, values)
+
+    def unpack(self, data, offset=0, endian=NATIVE_ENDIAN):
+        fmt = endian + "16f"
+        trans = list(struct.unpack_from(fmt, data, offset))
         self.mesh_transform = [trans[:4],trans[4:8],trans[8:12],trans[12:]]
-        offset += fmt_size
+        offset += struct.calcsize(fmt)
 
-        trans = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
+        trans = list(struct.unpack_from(fmt, data, offset))
         self.texture_transform = [trans[:4],trans[4:8],trans[8:12],trans[12:]]
-        offset += fmt_size
-
-        fmt = "256s"
-        fmt_size = struct.calcsize(fmt)
-        self.texture_map =\
-            struct.unpack(fmt,data[offset:offset+fmt_size])[0].replace('\0', '')
-        offset += fmt_size
-
-        fmt = "I I"
-        fmt_size = struct.calcsize(fmt)
-        (self.num_vertices, self.num_faces) = struct.unpack(fmt,\
-            data[offset:offset+fmt_size])
-        offset += fmt_size
-
-        fmt = "ffff"
-        fmt_size = struct.calcsize(fmt)
-
-        self.ambient = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-        offset += fmt_size
-
-        self.diffuse = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-        offset += fmt_size
-
-        self.specular = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-        offset += fmt_size
-
-        self.emissive = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-        offset += fmt_size
-
-        fmt = "f"
-        fmt_size = struct.calcsize(fmt)
-        self.shinyness = struct.unpack(fmt, data[offset:offset+fmt_size])
-        offset += fmt_size
-
-        fmt = "fff"
-        fmt_size = struct.calcsize(fmt)
-        for i in range(self.num_vertices):
-            vertex = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-            offset += fmt_size
-            self.vertices.append(vertex)
-
-        for i in range(self.num_vertices):
-            normal = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-            offset += fmt_size
-            self.normals.append(normal)
-
-        fmt = "ff"
-        fmt_size = struct.calcsize(fmt)
-
-        for i in range(self.num_vertices):
-            texcoord = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-            offset += fmt_size
-            self.texture_coords.append(texcoord)
-
-        fmt = "III"
-        fmt_size = struct.calcsize(fmt)
-
-        for i in range(self.num_faces):
-            face = list(struct.unpack(fmt, data[offset:offset+fmt_size]))
-            offset += fmt_size
-            self.indices.append(face)
+        offset += struct.calcsize(fmt)
+
+        fmt = endian + "256s II 4f 4f 4f 4f f"
+        values = struct.unpack_from(fmt, data, offset)
+        self.texture_map = values[0].replace('\0', '')
+        (self.num_vertices, self.num_faces) = values[1:3]
+        self.ambient = list(values[3:7])
+        self.diffuse = list(values[7:11])
+        self.specular = list(values[11:15])
+        self.emissive = list(values[15:19])
+        self.shininess = values[19]
+        offset += struct.calcsize(fmt)
+
+        count = self.num_vertices * 3
+        self.vertices = unpackArray(dom.FLOAT_TYPE, data, offset, count, endian)
+        offset += count * self.vertices.itemsize
+
+        self.normals = unpackArray(dom.FLOAT_TYPE, data, offset, count, endian)
+        offset += count * self.normals.itemsize
+
+        count = self.num_vertices * 2
+        self.texture_coords = unpackArray(dom.FLOAT_TYPE, data, offset, count,
+                endian)
+        offset += count * self.texture_coords.itemsize
+
+        count = self.num_faces * 3
+        self.indices = unpackArray(dom.INDEX_TYPE, data, offset, count, endian)
+        offset += count * self.indices.itemsize
 
         return offset
 
@@ -183,85 +204,223 @@ class SearObject:
         self.header = SearObjectHeader()
         self.meshes = []
 
+    def packSize(self):
+        size = struct.calcsize("8sHBI")
+        for mesh in self.meshes:
+            size += mesh.packSize()
+        return size
+
     def pack(self):
-        pack_str = ""
-        pack_str += self.header.pack()
+        pack_str = [self.header.pack()]
+        for mesh in self.meshes:
+            pack_str.append(mesh.pack())
+        return "".join(pack_str)
+
+    def write(self, out):
+        """Write the object to out mesh by mesh
+        """
+        out.write(self.header.pack())
         for mesh in self.meshes:
-            pack_str += mesh.pack()
-        return pack_str
+            mesh.write(out)
 
     def unpack(self, data):
         self.header = SearObjectHeader()
         offset = 0
         offset = self.header.unpack(data, offset)
-        while offset < len(data):
+        for i in xrange(self.header.num_meshes):
             mesh = SearObjectMesh()
-            offset = mesh.unpack(data, offset)
+            offset = mesh.unpack(data, offset, self.header.endian)
             self.meshes.append(mesh)
 
-def importAsset(model, asset):
-    sock = toolbox.openAny(asset)
-    data = sock.read()
-    sock.close()
+class SearReader:
+    """Random access to the meshes of a Sear object file.
+    The file is memory mapped if possible, see toolbox.Source. Only the
+    header and the size of every mesh are read up front, meshes are decoded
+    when they are accessed. Raises ValueError if the data is not a complete
+    Sear object file.
+    """
+    def __init__(self, asset):
+        self.source = toolbox.getSource(asset)
+        self.data = self.source.getBuffer()
+        try:
+            self.readIndex()
+        except ValueError:
+            self.close()
+            raise
+
+    def readIndex(self):
+        self.header = SearObjectHeader()
+        offset = self.header.unpack(self.data)
+
+        # (offset, num_vertices, num_faces) of every mesh
+        self.index = []
+        counts_fmt = self.header.endian + "II"
+        size = len(self.data)
+        for i in xrange(self.header.num_meshes):
+            if offset + MESH_HEADER_SIZE > size:
+                raise ValueError("truncated Sear object file")
+            (num_vertices, num_faces) = struct.unpack_from(counts_fmt,
+                    self.data, offset + MESH_COUNTS_OFFSET)
+            self.index.append((offset, num_vertices, num_faces))
+            offset += MESH_HEADER_SIZE + num_vertices * VERTEX_SIZE + \
+                    num_faces * FACE_SIZE
+            if offset > size:
+                raise ValueError("truncated Sear object file")
+
+    def getNumMeshes(self):
+        return len(self.index)
+
+    def getNumVertices(self, index):
+        return self.index[index][1]
+
+    def getNumFaces(self, index):
+        return self.index[index][2]
+
+    def getMesh(self, index):
+        """Decode mesh number "index"
+        """
+        mesh = SearObjectMesh()
+        mesh.unpack(self.data, self.index[index][0], self.header.endian)
+        return mesh
+
+    def getMeshes(self):
+        for i in xrange(self.getNumMeshes()):
+            yield self.getMesh(i)
+
+    def close(self):
+        self.data = None
+        self.source.close()
+
+def domMesh(sear_mesh):
+    """Create a DOM mesh from a SearObjectMesh
+    """
+    mesh = dom.Mesh.fromArrays(sear_mesh.vertices, sear_mesh.normals,
+            sear_mesh.texture_coords, sear_mesh.indices)
+    mesh.materials = dom.Materials()
+    mesh.materials.parent = mesh
+    material = dom.Material()
+    material.parent = mesh.materials
+    mesh.materials.materials.append(material)
+    material.path = sear_mesh.texture_map
+    return mesh
+
+def sniff(header):
+    """Check if data starting with "header" is a Sear object file
+    """
+    return header.startswith(SEAR_MAGIC)
+
+def openReader(asset):
+    """Open a SearReader, exiting with an error if the asset is not a
+    valid Sear object file
+    """
+    try:
+        with instrument.span("read") as span:
+            reader = SearReader(asset)
+            span.count(bytes=len(reader.data))
+    except ValueError, e:
+        print "'%s' is not a valid Sear object file: %s" % (asset, e)
+        sys.exit(1)
+    return reader
 
-    sear_object = SearObject()
-    sear_object.unpack(data)
-    #FIXME: put data from sear object into the DOM
-    # also, I'm just handling little endian encoded
+def importAsset(model, asset):
+    reader = openReader(asset)
 
     model.meshes = dom.Meshes()
-    for sear_mesh in sear_object.meshes:
-        mesh = dom.Mesh()
-        mesh.parent = model.meshes
-        model.meshes.meshes.append(mesh)
-        mesh.materials = dom.Materials()
-        mesh.materials.parent = mesh
-        material = dom.Material()
-        material.parent = mesh.materials
-        mesh.materials.materials.append(material)
-        material.path = sear_mesh.texture_map
-
-        mesh.vertices = dom.Vertices()
-        mesh.vertices.parent = mesh
-
-        i = 0
-        for sear_vertex in sear_mesh.vertices:
-            vertex = dom.Vertex()
-            vertex.parent = mesh.vertices
-            mesh.vertices.vertices.append(vertex)
-            vertex.position = sear_vertex
-            vertex.normals = sear_mesh.normals[i]
-            vertex.uv_coords = sear_mesh.texture_coords[i]
-            i+=1
-
-        mesh.faces = dom.Faces()
-        mesh.faces.parent = mesh
-
-        for sear_face in sear_mesh.indices:
-            face = dom.Face()
-            face.parent = mesh.faces
-            mesh.faces.faces.append(face)
-            face.vertex_list = sear_face
+    with instrument.span("decode") as span:
+        for sear_mesh in reader.getMeshes():
+            mesh = domMesh(sear_mesh)
+            mesh.parent = model.meshes
+            model.meshes.meshes.append(mesh)
+        span.countMeshes(model.getMeshes())
+
+    reader.close()
+
+def importMeshes(asset):
+    """Yield the meshes of an asset one by one, decoding each mesh only when
+    it is requested
+    """
+    reader = openReader(asset)
+    try:
+        for sear_mesh in reader.getMeshes():
+            with instrument.span("decode") as span:
+                mesh = domMesh(sear_mesh)
+                span.countMeshes([mesh])
+            yield mesh
+    finally:
+        reader.close()
+
+def searMesh(mesh):
+    """Create a SearObjectMesh sharing the buffers of a DOM mesh.
+    Missing normals and texture coordinates are written as zeros.
+    """
+    sear_mesh = SearObjectMesh()
+    if mesh.getMaterials():
+        sear_mesh.texture_map = mesh.getMaterials()[0].getPath()
+    sear_mesh.num_vertices = mesh.getNumVertices()
+    sear_mesh.num_faces = mesh.getNumFaces()
+    (positions, normals, uv_coords, indices) = mesh.toArrays()
+
+    sear_mesh.vertices = positions
+    sear_mesh.normals = normals
+    if len(normals) != len(positions):
+        sear_mesh.normals = zeroArray(dom.FLOAT_TYPE, len(positions))
+    sear_mesh.texture_coords = uv_coords
+    if len(uv_coords) != 2 * sear_mesh.num_vertices:
+        sear_mesh.texture_coords = zeroArray(dom.FLOAT_TYPE,
+                2 * sear_mesh.num_vertices)
+    sear_mesh.indices = indices
+    return sear_mesh
 
 def exportAsset(model, asset):
     out = toolbox.writeAny(asset)
     sear_object = SearObject()
     sear_object.header.num_meshes = model.getNumMeshes()
-    meshes = model.getMeshes()
+    with instrument.span("pack"):
+        sear_object.meshes = [searMesh(mesh) for mesh in model.getMeshes()]
+
+    # Regular files get their final size right away, so the file system
+    # can allocate it in one go
+    if isinstance(out, file):
+        try:
+            if out.tell() == 0:
+                out.truncate(sear_object.packSize())
+        except IOError:
+            # not seekable, e.g. a pipe
+            pass
+
+    with instrument.span("write") as span:
+        sear_object.write(out)
+        out.close()
+        span.count(bytes=sear_object.packSize())
+
+def exportMeshes(meshes, asset):
+    """Write the meshes one at a time. The header is written with a mesh
+    count of zero and patched at the end. If the output can't seek back, the
+    meshes have to be collected first.
+    """
+    out = toolbox.writeAny(asset)
+    header = SearObjectHeader()
+    try:
+        start = out.tell()
+        out.write(header.pack())
+    except (IOError, AttributeError):
+        # not seekable, e.g. a pipe
+        sear_object = SearObject()
+        sear_object.meshes = [searMesh(mesh) for mesh in meshes]
+        sear_object.header.num_meshes = len(sear_object.meshes)
+        sear_object.write(out)
+        out.close()
+        return
 
     for mesh in meshes:
-        sear_mesh = SearObjectMesh()
-        if mesh.getMaterials():
-            sear_mesh.texture_map = mesh.getMaterials()[0].getPath()
-        sear_mesh.num_vertices = mesh.getNumVertices()
-        for vertex in mesh.getVertices():
-            sear_mesh.vertices.append(vertex.getPosition())
-            sear_mesh.normals.append(vertex.getNormals())
-            tex_coords = vertex.getUVCoords()
-            sear_mesh.texture_coords.append(tex_coords and tex_coords or [0,0])
-        sear_mesh.num_faces = mesh.getNumFaces()
-        sear_mesh.indices = mesh.getFaces()
-        sear_object.meshes.append(sear_mesh)
-
-    out.write(sear_object.pack())
+        with instrument.span("write") as span:
+            sear_mesh = searMesh(mesh)
+            sear_mesh.write(out)
+            span.count(bytes=sear_mesh.packSize())
+        header.num_meshes += 1
+
+    end = out.tell()
+    out.seek(start)
+    out.write(header.pack())
+    out.seek(end)
     out.close()
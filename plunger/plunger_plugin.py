@@ -24,6 +24,8 @@ If they register themselves as handling import, they need to provide the
 importAsset() function.
 If they register themselves as handling export, they need to provide the
 exportAsset() function.
+
+Plugins can additionally support streaming, see StreamingPlungerPlugin.
 """
 
 class NotImplementedException(Exception):
@@ -45,3 +47,21 @@ class PlungerPlugin:
         """
         raise NotImplementedException
 
+class StreamingPlungerPlugin(PlungerPlugin):
+    """Protocol for plugins handling one mesh at a time.
+
+    If both the importer and the exporter of a conversion provide these
+    functions, the core hands the meshes from one to the other as they are
+    read, so only one mesh has to be kept in memory at a time.
+    """
+    def importMeshes(self, asset):
+        """Yield the meshes of an asset one by one, as dom.Mesh objects
+        """
+        raise NotImplementedException
+
+    def exportMeshes(self, meshes, asset):
+        """Export the meshes of the iterable "meshes", each one as soon as it
+        arrives
+        """
+        raise NotImplementedException
+
@@ -21,20 +21,37 @@ The plunger main program will load all plugins and register them using
 the register() function.
 """
 
+import importlib
 import os
 import sys
+import threading
+
+import toolbox
 
 export_formats = {}
 import_formats = {}
+# (magic bytes, XML root element) of the import formats registered with them
+signatures = {}
+
+# Plugins are loaded once per process and then shared read-only by all
+# conversions.
+plugins_loaded = False
+load_lock = threading.Lock()
 
-def register(module, format, does_import=False, does_export=False):
+def register(module, format, does_import=False, does_export=False,
+        magic=None, root_element=None):
     """Register an import or export module.
-    module would be the class that exports/imports data.
+    module would be the class that exports/imports data, or the name of the
+    module to import when the format is used for the first time.
     format is a string representation of the format.
     does_import should be set to true of t
+    magic and root_element are the first bytes or the XML root element of
+    the imported files, they detect the format without importing the module.
     """
     if does_import:
         import_formats[format]=module
+        if magic or root_element:
+            signatures[format] = (magic, root_element)
 
     if does_export:
         export_formats[format]=module
@@ -52,22 +69,111 @@ def getImportFormats():
 def getExporter(format):
     """Get an exporter for "format"
     """
-    return export_formats[format]
+    return loadModule(export_formats, format)
 
 def getImporter(format):
     """Get an importer for "format"
     """
-    return import_formats[format]
+    return loadModule(import_formats, format)
+
+def loadModule(formats, format):
+    """Get the module registered for "format", importing it first if only its
+    name was registered.
+    """
+    module = formats[format]
+    if not isinstance(module, basestring):
+        return module
+
+    load_lock.acquire()
+    try:
+        module = formats[format]
+        if isinstance(module, basestring):
+            name = module
+            module = importlib.import_module(name)
+            # the module might handle import and export
+            for registered in (import_formats, export_formats):
+                for key, value in registered.items():
+                    if value == name:
+                        registered[key] = module
+    finally:
+        load_lock.release()
+    return module
+
+def sniffFormat(header):
+    """Detect the import format of an asset from its first bytes, by matching
+    the registered signatures, or else by asking the sniff(header) function
+    of the importer. The header of compressed data has to be decompressed
+    already, like the one of toolbox.peekSource(). Returns None if no
+    importer recognizes it.
+    """
+    root_element = toolbox.getRootElement(header)
+    for format in sorted(import_formats.keys()):
+        if format in signatures:
+            (magic, root) = signatures[format]
+            if magic and header.startswith(magic):
+                return format
+            if root and root == root_element:
+                return format
+            continue
+        sniff = getattr(getImporter(format), "sniff", None)
+        if sniff and sniff(header):
+            return format
+    return None
+
+def formatFromName(name):
+    """Get the import format whose file name extension "name" has, ignoring
+    the extension of a compressed format. This imports the importers to get
+    their extensions. Returns None if no importer matches.
+    """
+    name = toolbox.splitCompressedExt(name)[0]
+    matches = []
+    for format in sorted(import_formats.keys()):
+        ext = getattr(getImporter(format), "ext", "")
+        if ext and name.endswith(ext):
+            matches.append((len(ext), format))
+    if not matches:
+        return None
+    return max(matches)[1]
+
+def detectFormat(source):
+    """Detect the import format of a source by reading its first bytes, or
+    if they are inconclusive by its file name extension.
+    Returns (format, source), see toolbox.peekSource() for the source.
+    """
+    name = source
+    (header, source) = toolbox.peekSource(source)
+    format = sniffFormat(header)
+    if format is None and isinstance(name, basestring):
+        format = formatFromName(name)
+    return (format, source)
 
 def loadPlugins(plugin_dir):
+    """Load and register all plugins. Calling this again is cheap, the plugins
+    are only loaded the first time.
+    """
+    global plugins_loaded
+    load_lock.acquire()
+    try:
+        if not plugins_loaded:
+            doLoadPlugins(plugin_dir)
+            plugins_loaded = True
+    finally:
+        load_lock.release()
+
+def doLoadPlugins(plugin_dir):
+    """Register the plugins listed in the plugin manifest, they are imported
+    on first use. Without the plunger package, import all plugins found in
+    plugin_dir right away.
+    """
     plugins = []
     try:
-        import plunger.plugins
-        for plugin in plunger.plugins.__all__:
-            module = __import__("plunger.plugins.%s" % plugin, fromlist=["plunger", "plugins"])
-            register(module, module.format, module.does_import, module.does_export)
+        from plunger.plugins import manifest
+        for (plugin, format, does_import, does_export, magic,
+                root_element) in manifest:
+            register("plunger.plugins.%s" % plugin, format, does_import,
+                    does_export, magic, root_element)
     except ImportError:
-    	for filename in os.listdir(plugin_dir):
+        for filename in os.listdir(plugin_dir):
             name, ext = os.path.splitext(filename)
             if ext == ".py" and name != "__init__":
                 plugins.append(name)
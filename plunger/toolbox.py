@@ -18,40 +18,512 @@
 """A collection of helper functions.
 """
 
-def openAny(source):
-    """Open any type of source, return a stream
+import array
+import bz2
+import codecs
+import errno
+import mmap
+import os
+import re
+import stat
+import struct
+import sys
+import urlparse
+import zlib
+
+import instrument
+
+# Size of the text chunks numbers are parsed in, in characters
+PARSE_CHUNK_SIZE = 1 << 16
+# Amount of output collected before it is written out, in characters
+WRITE_BUFFER_SIZE = 1 << 16
+# Number of bytes read to detect the format of a source
+SNIFF_SIZE = 512
+# Amount of compressed data read at a time, in bytes
+COMPRESSED_CHUNK_SIZE = 1 << 16
+
+# Compressed stream formats that are read and written on the fly, with
+# their magic bytes and file name extension
+COMPRESSIONS = (
+    ("gzip", "\x1f\x8b", ".gz"),
+    ("bzip2", "BZh", ".bz2"),
+    ("xz", "\xfd7zXZ\x00", ".xz"),
+)
+# Number of bytes needed to recognize all compressed formats
+MAGIC_SIZE = 6
+
+whitespace_re = re.compile(r"\s")
+# Whitespace, XML declaration, comments and doctype before the root element
+xml_root_re = re.compile(r"(?:\s+|<\?.*?\?>|<!--.*?-->|"
+        r"<!DOCTYPE[^>\[]*(?:\[.*?\])?\s*>)*<([\w:.-]+)", re.S)
+
+# URL schemes handed to urllib, everything else is a local path
+URL_SCHEMES = ("file", "ftp", "http", "https")
+
+def getCompression(header=None, name=None):
+    """Get the compression of a stream from its first bytes, or if they
+    aren't given from its file name. Returns None if it isn't compressed.
     """
-    #if it's already a stream, we're done
-    if hasattr(source, "read"):
-        return source
+    for (compression, magic, ext) in COMPRESSIONS:
+        if header is not None:
+            if header.startswith(magic):
+                return compression
+        elif name is not None and name.endswith(ext):
+            return compression
+    return None
 
-    if source == "-":
-        import sys
-        return sys.stdin
+def splitCompressedExt(name):
+    """Split the extension of a compressed format off a file name. Returns
+    (name, ext), ext is empty if the name has no such extension.
+    """
+    for (compression, magic, ext) in COMPRESSIONS:
+        if name.endswith(ext):
+            return (name[:-len(ext)], ext)
+    return (name, "")
 
-    import urllib
+def getLzma():
+    """Get the lzma module for xz streams, it comes with Python 3.3 and the
+    backports.lzma package
+    """
     try:
-        return urllib.urlopen(source)
-    except (IOError, OSError):
-        pass
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise IOError("xz streams need the lzma module")
+    return lzma
+
+def newDecompressor(compression):
+    if compression == "gzip":
+        # 16 + MAX_WBITS expects a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == "bzip2":
+        return bz2.BZ2Decompressor()
+    return getLzma().LZMADecompressor()
+
+def newCompressor(compression):
+    if compression == "gzip":
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                16 + zlib.MAX_WBITS)
+    if compression == "bzip2":
+        return bz2.BZ2Compressor()
+    return getLzma().LZMACompressor()
+
+class DecompressingStream:
+    """Decompress a stream chunk by chunk while it is read. Concatenated
+    compressed streams, like those of pigz or "cat a.gz b.gz", are read one
+    after the other.
+    """
+    def __init__(self, stream, compression):
+        self.stream = stream
+        self.compression = compression
+        self.decompressor = newDecompressor(compression)
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def decompress(self, data):
+        chunks = []
+        while data:
+            try:
+                chunks.append(self.decompressor.decompress(data))
+            except EOFError:
+                # the last stream ended right at the end of the last chunk
+                self.decompressor = newDecompressor(self.compression)
+                continue
+            # data after the end of a stream, ignore padding
+            data = self.decompressor.unused_data.lstrip("\0")
+            if data:
+                self.decompressor = newDecompressor(self.compression)
+        return "".join(chunks)
+
+    def fill(self, size):
+        """Decompress until "size" bytes are buffered or the stream ends, a
+        negative size decompresses everything
+        """
+        length = len(self.buffer) - self.pos
+        if self.eof or 0 <= size <= length:
+            return
+        chunks = [self.buffer[self.pos:]]
+        while size < 0 or length < size:
+            data = self.stream.read(COMPRESSED_CHUNK_SIZE)
+            if not data:
+                self.eof = True
+                break
+            chunk = self.decompress(data)
+            chunks.append(chunk)
+            length += len(chunk)
+        self.buffer = "".join(chunks)
+        self.pos = 0
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self.fill(size)
+        if size < 0:
+            end = len(self.buffer)
+        else:
+            end = self.pos + size
+        data = self.buffer[self.pos:end]
+        self.pos += len(data)
+        return data
 
+    def close(self):
+        self.buffer = ""
+        self.pos = 0
+        self.stream.close()
+
+class CompressingStream:
+    """Compress data while it is written, close() writes the end of the
+    compressed stream
+    """
+    def __init__(self, stream, compressor):
+        self.stream = stream
+        self.compressor = compressor
+
+    def write(self, data):
+        data = self.compressor.compress(data)
+        if data:
+            self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        if self.compressor is not None:
+            self.stream.write(self.compressor.flush())
+            self.compressor = None
+        self.stream.close()
+
+def peekStream(stream, size):
+    """Read the first "size" bytes of a stream without using them up.
+    Returns (header, stream), streams that can't seek back are replaced by
+    a PeekedStream.
+    """
     try:
-        return open(source)
-    except (IOError, OSError):
-        pass
+        pos = stream.tell()
+        stream.seek(pos)
+    except (AttributeError, EnvironmentError, ValueError):
+        header = stream.read(size)
+        return (header, PeekedStream(header, stream))
+    header = stream.read(size)
+    stream.seek(pos)
+    return (header, stream)
+
+class Source:
+    """Where the data of an asset comes from: a local file, a stream, bytes
+    in memory or a URL.
+
+    Local files are opened directly and in binary mode. Binary readers can
+    get all data with getBuffer(), which maps files instead of reading them,
+    and getSize() tells the size before anything is read, if it is known.
+    Bytes in memory are used as they are. Strings are taken as file names,
+    use fromData() for a string holding the data itself. A file name that
+    doesn't exist raises IOError.
+
+    Compressed data is recognized by its magic bytes and decompressed while
+    it is read.
+    """
+    def __init__(self, source):
+        self.path = None
+        self.data = None
+        self.stream = None
+        self.url = None
+        self.response = None
+        self.map = None
+        self.compression = None
+        # the stream of a stream or URL, which can only be read once
+        self.reader = None
+        # streams opened by the source, closed by close()
+        self.opened = []
+
+        if hasattr(source, "read"):
+            self.stream = source
+        elif isinstance(source, (bytearray, buffer, mmap.mmap)):
+            self.data = source
+        elif source == "-":
+            self.stream = sys.stdin
+        elif urlparse.urlsplit(source).scheme in URL_SCHEMES:
+            self.url = source
+        elif os.path.exists(source):
+            self.path = source
+        else:
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), source)
+
+    @classmethod
+    def fromData(cls, data):
+        """Create a source for data in memory, which can be a string
+        """
+        source = cls(bytearray())
+        source.data = data
+        return source
+
+    def getSize(self):
+        """Get the size of the data in bytes, or None if it isn't known
+        before reading it. This is the compressed size of compressed data.
+        """
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        if self.data is not None:
+            return len(self.data)
+        if self.url is not None:
+            # the length of an HTTP response is in its headers
+            self.open()
+            length = self.response.info().getheader("Content-Length")
+            if length:
+                return int(length)
+            return None
+        try:
+            status = os.fstat(self.stream.fileno())
+        except (AttributeError, EnvironmentError, ValueError):
+            return None
+        if stat.S_ISREG(status.st_mode):
+            return status.st_size
+        return None
+
+    def open(self):
+        """Get a stream of the data, decompressing it if it is compressed
+        """
+        if self.reader is not None:
+            return self.reader
+        if self.stream is not None:
+            stream = self.stream
+        else:
+            if self.path is not None:
+                stream = open(self.path, "rb")
+            elif self.data is not None:
+                import cStringIO
+                stream = cStringIO.StringIO(self.data)
+            else:
+                import urllib
+                stream = self.response = urllib.urlopen(self.url)
+            self.opened.append(stream)
+
+        (header, stream) = peekStream(stream, MAGIC_SIZE)
+        self.compression = getCompression(header)
+        if self.compression:
+            stream = DecompressingStream(stream, self.compression)
+        if self.path is None and self.data is None:
+            self.reader = stream
+        return stream
 
-    # treat source as string
-    import StringIO
-    return StringIO.StringIO(str(source))
+    def getBuffer(self):
+        """Get all data as a buffer. Files are memory mapped, streams of a
+        known size are read into a buffer allocated up front.
+        """
+        if self.data is not None and \
+                not getCompression(str(self.data[:MAGIC_SIZE])):
+            return self.data
+        stream = self.open()
+        size = self.getSize()
+        if size and not self.compression:
+            try:
+                self.map = mmap.mmap(stream.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+                return self.map
+            except (AttributeError, EnvironmentError, ValueError):
+                # not a regular file, e.g. a pipe
+                pass
+            if hasattr(stream, "readinto"):
+                data = bytearray(size)
+                view = memoryview(data)
+                pos = 0
+                while pos < size:
+                    count = stream.readinto(view[pos:])
+                    if not count:
+                        break
+                    pos += count
+                del data[pos:]
+                return data
+        return stream.read()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        for stream in self.opened:
+            stream.close()
+        self.opened = []
+        self.reader = None
+
+def getSource(source):
+    """Wrap anything openAny() takes in a Source, unless it is one already
+    """
+    if isinstance(source, Source):
+        return source
+    return Source(source)
+
+def openAny(source):
+    """Open any type of source, return a stream
+    """
+    with instrument.span("open") as span:
+        source = getSource(source)
+        stream = source.open()
+        size = source.getSize()
+        if size is not None:
+            span.count(bytes=size)
+    return stream
+
+class PeekedStream:
+    """A stream whose first bytes were already read, e.g. to detect its
+    format. read() returns them again before the rest of the stream.
+    """
+    def __init__(self, header, stream):
+        self.header = header
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.header:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data = self.header + self.stream.read()
+            self.header = ""
+            return data
+        data = self.header[:size]
+        self.header = self.header[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+    def close(self):
+        self.stream.close()
+
+def peekSource(source, size=SNIFF_SIZE):
+    """Read the first "size" bytes of a source. Returns (header, source).
+    Sources that can't be read twice, like stdin, are replaced by a
+    PeekedStream, which has to be used in place of the original source.
+    """
+    wrapped = getSource(source)
+    if wrapped.data is not None:
+        header = str(wrapped.data[:size])
+        if not getCompression(header):
+            return (header, source)
+    if wrapped.path is not None or wrapped.data is not None:
+        # a new source is opened on every use
+        peeked = Source.fromData(wrapped.data)
+        peeked.path = wrapped.path
+        try:
+            return (peeked.open().read(size), source)
+        finally:
+            peeked.close()
+
+    stream = wrapped.open()
+    header = stream.read(size)
+    return (header, PeekedStream(header, stream))
+
+def getRootElement(header):
+    """Get the name of the root element of an XML document from its first
+    bytes, without namespace prefix. Returns None if it isn't found.
+    """
+    if header.startswith(codecs.BOM_UTF8):
+        header = header[len(codecs.BOM_UTF8):]
+    match = xml_root_re.match(header)
+    if not match:
+        return None
+    return match.group(1).split(":")[-1]
+
+class BufferedWriter:
+    """Collect many small strings and write them to a stream in large chunks
+    """
+    def __init__(self, out, buffer_size=WRITE_BUFFER_SIZE):
+        self.out = out
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+
+    def write(self, string):
+        self.buffer.append(string)
+        self.size += len(string)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.out.write("".join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+float32 = struct.Struct("f")
+
+def formatFloat(value):
+    """Format a value stored as a 32 bit float with the fewest digits that
+    read back as the same float, like "315.16" or "0".
+    """
+    if not value:
+        # no "-0" for negated zeros
+        return "0"
+    for digits in ("%.6g", "%.7g", "%.8g"):
+        text = digits % value
+        if float32.unpack(float32.pack(float(text)))[0] == value:
+            return text
+    return "%.9g" % value
 
 def writeAny(dest):
-    """Openy any type of destination for writing
+    """Openy any type of destination for writing. Files with the extension
+    of a compressed format are compressed while they are written.
     """
     if hasattr(dest, "write"):
         return dest
 
     if dest == "-":
-        import sys
         return sys.stdout
 
-    return open(dest, 'w')
+    compression = getCompression(name=dest)
+    if compression:
+        compressor = newCompressor(compression)
+        return CompressingStream(open(dest, 'wb'), compressor)
+    return open(dest, 'wb')
+
+def splitText(text, chunk_size=PARSE_CHUNK_SIZE):
+    """Split "text" into chunks of about "chunk_size" characters, only
+    splitting on whitespace.
+    """
+    start = 0
+    length = len(text)
+    while start < length:
+        end = start + chunk_size
+        if end >= length:
+            yield text[start:]
+            return
+        match = whitespace_re.search(text, end)
+        if not match:
+            yield text[start:]
+            return
+        yield text[start:match.start()]
+        start = match.end()
+
+def parseChunk(typecode, text):
+    """Parse the whitespace separated numbers in "text" into an array
+    """
+    if typecode in "fd":
+        return array.array(typecode, map(float, text.split()))
+    return array.array(typecode, map(int, text.split()))
+
+def parseArray(typecode, text, count=None):
+    """Parse whitespace separated numbers into an array of type "typecode".
+    If count is given, the array is preallocated and at most count numbers
+    are read. Large texts are parsed chunk by chunk.
+    """
+    if count is None:
+        values = array.array(typecode)
+    else:
+        values = array.array(typecode, [0]) * count
+
+    pos = 0
+    for chunk in splitText(text):
+        chunk_values = parseChunk(typecode, chunk)
+
+        if count is None:
+            values.extend(chunk_values)
+            continue
+
+        chunk_values = chunk_values[:count - pos]
+        values[pos:pos + len(chunk_values)] = chunk_values
+        pos += len(chunk_values)
+        if pos >= count:
+            break
+
+    if count is not None and pos < count:
+        del values[pos:]
+    return values
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007 by Kai Blin
+#
+# Plunger is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""Transform the geometry of a model between import and export.
+
+Transforms are 4x4 affine matrices given as lists of rows. They are applied
+to the flat position and normal arrays of a mesh one axis at a time, without
+going through Vertex objects.
+"""
+
+import array
+import math
+from itertools import izip
+
+import dom
+
+AXES = ("x", "y", "z")
+
+def identity():
+    return [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0],
+            [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]]
+
+def multiply(a, b):
+    """Get the matrix product a * b, applying b first and then a
+    """
+    return [[sum([a[row][i] * b[i][column] for i in range(4)])
+            for column in range(4)] for row in range(4)]
+
+def translation(x, y, z):
+    matrix = identity()
+    matrix[0][3] = x
+    matrix[1][3] = y
+    matrix[2][3] = z
+    return matrix
+
+def scaling(x, y, z):
+    matrix = identity()
+    matrix[0][0] = x
+    matrix[1][1] = y
+    matrix[2][2] = z
+    return matrix
+
+def rotation(axis, degrees):
+    """Get the matrix rotating by "degrees" counter-clockwise around the x, y
+    or z axis
+    """
+    angle = math.radians(degrees)
+    cos = math.cos(angle)
+    sin = math.sin(angle)
+    (i, j) = {"x": (1, 2), "y": (2, 0), "z": (0, 1)}[axis]
+    matrix = identity()
+    matrix[i][i] = cos
+    matrix[i][j] = -sin
+    matrix[j][i] = sin
+    matrix[j][j] = cos
+    return matrix
+
+def isAffine(matrix):
+    return len(matrix) == 4 and \
+            [len(row) for row in matrix] == [4, 4, 4, 4] and \
+            list(matrix[3]) == [0, 0, 0, 1]
+
+def determinant(matrix):
+    """Get the determinant of the upper 3x3 part of a matrix
+    """
+    m = matrix
+    return m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1]) - \
+            m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0]) + \
+            m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0])
+
+def normalMatrix(matrix):
+    """Get the 3x3 matrix transforming normals, the inverse transpose of the
+    upper 3x3 part of matrix. It is scaled so it keeps normals at unit
+    length if matrix only rotates and scales uniformly. Returns
+    (normal matrix, whether normals need to be normalised afterwards).
+    Singular matrices, like a scale by 0 along an axis, get the cofactor
+    matrix, which still points normals the right way, e.g. along the
+    flattened axis.
+    """
+    det = determinant(matrix)
+    if not det:
+        det = 1.0
+    m = matrix
+    # the transposed cofactor matrix divided by the determinant is the
+    # inverse, so the cofactor matrix itself is the inverse transpose
+    result = [[(m[(row+1)%3][(column+1)%3] * m[(row+2)%3][(column+2)%3] -
+            m[(row+1)%3][(column+2)%3] * m[(row+2)%3][(column+1)%3]) / det
+            for column in range(3)] for row in range(3)]
+
+    # rows of the same length, orthogonal to each other
+    products = [[sum([result[a][i] * result[b][i] for i in range(3)])
+            for b in range(3)] for a in range(3)]
+    length = products[0][0]
+    tolerance = 1e-9 * length
+    uniform = length > 0
+    for a in range(3):
+        for b in range(3):
+            expected = 0.0
+            if a == b:
+                expected = length
+            if abs(products[a][b] - expected) > tolerance:
+                uniform = False
+    if uniform:
+        factor = 1 / math.sqrt(length)
+        result = [[value * factor for value in row] for row in result]
+    return (result, not uniform)
+
+def combine(coefficients, axes, offset=0.0, typecode=dom.FLOAT_TYPE):
+    """Compute coefficients[0] * axes[0] + ... + offset for every element of
+    the axes, leaving out terms with a zero coefficient.
+    """
+    terms = [(c, axis) for (c, axis) in zip(coefficients, axes) if c]
+    count = len(axes[0])
+    if not terms:
+        return array.array(typecode, [offset]) * count
+    if len(terms) == 1:
+        ((a, xs),) = terms
+        if a == 1 and not offset:
+            return array.array(typecode, xs)
+        return array.array(typecode, [a * x + offset for x in xs])
+    if len(terms) == 2:
+        ((a, xs), (b, ys)) = terms
+        return array.array(typecode, [a * x + b * y + offset
+                for (x, y) in izip(xs, ys)])
+    ((a, xs), (b, ys), (c, zs)) = terms
+    return array.array(typecode, [a * x + b * y + c * z + offset
+            for (x, y, z) in izip(xs, ys, zs)])
+
+def transformVectors(vectors, matrix, offsets=(0.0, 0.0, 0.0)):
+    """Multiply a flat array of 3d vectors by a 3x3 (or the upper part of a
+    4x4) matrix and add offsets, one output axis at a time
+    """
+    axes = [vectors[i::3] for i in range(3)]
+    result = array.array(dom.FLOAT_TYPE, [0]) * len(vectors)
+    for row in range(3):
+        result[row::3] = combine(matrix[row][:3], axes, offsets[row])
+    return result
+
+def normalizeVectors(vectors):
+    """Scale a flat array of 3d vectors to unit length, zero length vectors
+    stay zero
+    """
+    axes = [vectors[i::3] for i in range(3)]
+    factors = [0.0] * len(axes[0])
+    for (i, (x, y, z)) in enumerate(izip(*axes)):
+        length = math.sqrt(x * x + y * y + z * z)
+        if length:
+            factors[i] = 1 / length
+    result = array.array(dom.FLOAT_TYPE, [0]) * len(vectors)
+    for i in range(3):
+        result[i::3] = array.array(dom.FLOAT_TYPE,
+                [v * f for (v, f) in izip(axes[i], factors)])
+    return result
+
+def transformMesh(mesh, matrix):
+    """Apply an affine matrix to the positions, normals and face normals of a
+    mesh. Faces are flipped if the matrix mirrors the mesh, so they keep
+    facing outwards.
+    """
+    offsets = [matrix[row][3] for row in range(3)]
+    mesh.positions = transformVectors(mesh.positions, matrix, offsets)
+
+    (normal_matrix, renormalize) = normalMatrix(matrix)
+    if mesh.normals:
+        mesh.normals = transformVectors(mesh.normals, normal_matrix)
+        if renormalize:
+            mesh.normals = normalizeVectors(mesh.normals)
+    if mesh.face_normals:
+        mesh.face_normals = transformVectors(mesh.face_normals,
+                normal_matrix)
+        if renormalize:
+            mesh.face_normals = normalizeVectors(mesh.face_normals)
+
+    if determinant(matrix) < 0:
+        indices = mesh.indices
+        (indices[1::3], indices[2::3]) = (indices[2::3], indices[1::3])
+
+def modelBounds(model):
+    """Get the (min, max) corners of the bounding box of all meshes, or None
+    if the model has no vertices
+    """
+    bounds = None
+    for mesh in model.getMeshes():
+        if not mesh.positions:
+            continue
+        axes = [mesh.positions[i::3] for i in range(3)]
+        low = [min(axis) for axis in axes]
+        high = [max(axis) for axis in axes]
+        if bounds:
+            low = [min(a, b) for (a, b) in zip(low, bounds[0])]
+            high = [max(a, b) for (a, b) in zip(high, bounds[1])]
+        bounds = (low, high)
+    return bounds
+
+class Transform:
+    """A transformation of all meshes of a model.
+
+    If recenter is set, the model is first moved so the center of its
+    bounding box is at the origin. If unit_scale is set, it is then scaled
+    so the largest side of its bounding box is 1. Finally, the matrix built
+    by translate(), scale(), rotate() and applyMatrix() is applied, in the
+    order these were called.
+    """
+    def __init__(self):
+        self.recenter = False
+        self.unit_scale = False
+        self.matrix = identity()
+
+    def applyMatrix(self, matrix):
+        """Apply an affine 4x4 matrix after the current transformation
+        """
+        matrix = [[float(value) for value in row] for row in matrix]
+        if not isAffine(matrix):
+            raise ValueError("the last row of the matrix has to be 0 0 0 1")
+        self.matrix = multiply(matrix, self.matrix)
+        return self
+
+    def translate(self, x, y, z):
+        return self.applyMatrix(translation(x, y, z))
+
+    def scale(self, x, y=None, z=None):
+        """Scale by x, y and z, or uniformly if only x is given
+        """
+        if y is None:
+            y = x
+        if z is None:
+            z = x
+        return self.applyMatrix(scaling(x, y, z))
+
+    def rotate(self, axis, degrees):
+        if axis not in AXES:
+            raise ValueError("the rotation axis has to be x, y or z")
+        return self.applyMatrix(rotation(axis, degrees))
+
+    def needsModel(self):
+        """Check if the whole model has to be known to compute the matrix
+        """
+        return self.recenter or self.unit_scale
+
+    def applyMesh(self, mesh):
+        """Apply the matrix to a single mesh, ignoring recenter and
+        unit_scale
+        """
+        if self.matrix != identity():
+            transformMesh(mesh, self.matrix)
+
+    def isIdentity(self):
+        return not self.recenter and not self.unit_scale and \
+                self.matrix == identity()
+
+    def describe(self):
+        """Get a string describing the transformation, e.g. for cache keys
+        """
+        return "recenter=%s unit_scale=%s matrix=%r" % (self.recenter,
+                self.unit_scale, self.matrix)
+
+    def getMatrix(self, model):
+        """Get the complete matrix for a model, including moving it to the
+        origin and scaling it to unit size
+        """
+        matrix = identity()
+        if self.recenter or self.unit_scale:
+            bounds = modelBounds(model)
+            if bounds:
+                (low, high) = bounds
+                if self.recenter:
+                    matrix = translation(*[-(a + b) / 2.0
+                            for (a, b) in zip(low, high)])
+                size = max([b - a for (a, b) in zip(low, high)])
+                if self.unit_scale and size:
+                    factor = 1.0 / size
+                    matrix = multiply(scaling(factor, factor, factor),
+                            matrix)
+        return multiply(self.matrix, matrix)
+
+    def apply(self, model):
+        """Transform all meshes of a model, one pass per mesh
+        """
+        if self.isIdentity():
+            return
+        matrix = self.getMatrix(model)
+        for mesh in model.getMeshes():
+            transformMesh(mesh, matrix)
+
+# Command line options handled by applyOption(), for getopt
+OPTIONS = ["translate=", "scale=", "rotate=", "matrix=", "recenter",
+        "unit-scale"]
+
+def parseNumbers(text, counts):
+    """Parse comma separated numbers, raise ValueError unless there are as
+    many as one of the numbers in counts
+    """
+    values = [float(value) for value in text.split(",")]
+    if len(values) not in counts:
+        raise ValueError("expected %s comma separated numbers" %
+                " or ".join([str(count) for count in counts]))
+    return values
+
+def applyOption(transform, option, value):
+    """Apply a command line option like "--scale" with its value to a
+    Transform. Raises ValueError if the value is invalid.
+    """
+    if option == "--translate":
+        transform.translate(*parseNumbers(value, (3,)))
+    elif option == "--scale":
+        transform.scale(*parseNumbers(value, (1, 3)))
+    elif option == "--rotate":
+        (axis, sep, degrees) = value.partition(",")
+        transform.rotate(axis.lower(), float(degrees))
+    elif option == "--matrix":
+        values = parseNumbers(value, (12, 16))
+        if len(values) == 12:
+            values.extend([0, 0, 0, 1])
+        transform.applyMatrix([values[i:i+4] for i in range(0, 16, 4)])
+    elif option == "--recenter":
+        transform.recenter = True
+    elif option == "--unit-scale":
+        transform.unit_scale = True
+    else:
+        raise ValueError("unknown option")
+
+# Help text for the options, for the usage of the command line tools
+USAGE = """--translate=<x>,<y>,<z>         Move the model.
+--scale=<factor>|<x>,<y>,<z>    Scale the model.
+--rotate=<axis>,<degrees>       Rotate the model around the x, y or z axis.
+--matrix=<m11>,<m12>,...,<m34>[,0,0,0,1]
+                                Transform the model by a 4x4 matrix, given
+                                row by row.
+--recenter                      Move the center of the model to the origin,
+                                before the transformations above.
+--unit-scale                    Scale the model to a size of 1, after
+                                recentering it.
+"""
@@ -6,7 +6,7 @@ setup(name='plunger',
       author='Kai Blin',
       author_email='kai.blin@gmail.com',
       url='http://wiki.worldforge.org/wiki/Plunger',
-      scripts=['plunger/plunger'],
+      scripts=['plunger/plunger', 'plunger/plunger-client'],
       packages=['plunger', 'plunger.plugins', 'plunger.plugins.collada_plugin',
 	'plunger.plugins.ogrexml_plugin'],
 #      data_files=[('share/doc/plunger', ['AUTHORS', 'ChangeLog', 'COPYING', 'INSTALL',